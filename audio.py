@@ -0,0 +1,277 @@
+import os
+import re
+import asyncio
+import shutil
+import tempfile
+import logging
+from bisect import bisect_left, bisect_right
+from typing import List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Configuración del preprocesamiento de audio (requiere ffmpeg en el PATH)
+AUDIO_PREPROCESSING = os.getenv("AUDIO_PREPROCESSING", "true").lower() == "true"
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "24k")
+
+# Configuración de la transcripción por fragmentos para grabaciones largas
+CHUNKING_ENABLED = os.getenv("CHUNKING_ENABLED", "true").lower() == "true"
+CHUNK_DURATION = float(os.getenv("CHUNK_DURATION", "120"))  # Segundos objetivo por fragmento
+CHUNK_OVERLAP = float(os.getenv("CHUNK_OVERLAP", "1.0"))  # Segundos de solapamiento a cada lado
+SILENCE_THRESHOLD_DB = float(os.getenv("SILENCE_THRESHOLD_DB", "-35"))
+SILENCE_MIN_DURATION = float(os.getenv("SILENCE_MIN_DURATION", "0.4"))
+
+# Configuración del recorte de silencios (VAD por energía)
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() == "true"
+VAD_MIN_SILENCE = float(os.getenv("VAD_MIN_SILENCE", "1.0"))  # Solo se eliminan pausas de al menos esta duración
+VAD_PADDING = float(os.getenv("VAD_PADDING", "0.25"))  # Segundos de margen conservados alrededor de la voz
+VAD_MIN_SAVINGS = float(os.getenv("VAD_MIN_SAVINGS", "2.0"))  # Segundos mínimos a recortar para que valga la pena
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_PROGRESS_TIME_RE = re.compile(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+_SILENCE_START_RE = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+_SILENCE_END_RE = re.compile(r"silence_end: (\d+(?:\.\d+)?)")
+
+class AudioChunk(NamedTuple):
+    """Fragmento de audio: el archivo cubre [start, end] y aporta al resultado solo [keep_start, keep_end)"""
+    path: str
+    start: float
+    end: float
+    keep_start: float
+    keep_end: float
+
+class TimeMap:
+    """Correspondencia entre la línea de tiempo del audio recortado y la del video original"""
+
+    def __init__(self, spans: List[Tuple[float, float]]):
+        self.spans = spans  # Tramos (inicio, fin) del original que se conservaron, en orden
+        self.offsets = []  # Inicio de cada tramo en el audio recortado
+        position = 0.0
+        for start, end in spans:
+            self.offsets.append(position)
+            position += end - start
+        self.trimmed_duration = position
+
+    def to_original(self, t: float, is_end: bool = False) -> float:
+        """Convierte un instante del audio recortado al original.
+
+        Un fin de segmento justo en la unión de dos tramos se asigna al final del tramo anterior.
+        """
+        if not self.spans:
+            return t
+        index = (bisect_left(self.offsets, t) if is_end else bisect_right(self.offsets, t)) - 1
+        index = min(max(index, 0), len(self.spans) - 1)
+        start, end = self.spans[index]
+        return min(start + (t - self.offsets[index]), end)
+
+class AudioProcessingError(Exception):
+    """Error al ejecutar ffmpeg"""
+
+def ffmpeg_available() -> bool:
+    """Indica si el binario de ffmpeg está instalado"""
+    return shutil.which(FFMPEG_BINARY) is not None
+
+def make_temp_path(suffix: str) -> str:
+    """Crea un archivo temporal vacío y devuelve su ruta"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+async def run_ffmpeg(*args: str) -> str:
+    """Ejecuta ffmpeg sin bloquear el event loop y devuelve su stderr (donde escribe sus reportes)"""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_BINARY, "-nostdin", "-hide_banner", *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    output = stderr.decode(errors="replace")
+    if process.returncode != 0:
+        raise AudioProcessingError(f"ffmpeg terminó con código {process.returncode}: {output[-500:]}")
+    return output
+
+# Función para obtener la duración de un archivo multimedia
+async def probe_duration(media_path: str) -> Optional[float]:
+    """Duración en segundos según ffprobe, o None si no se puede determinar"""
+    if shutil.which(FFPROBE_BINARY) is None:
+        return None
+    process = await asyncio.create_subprocess_exec(
+        FFPROBE_BINARY, "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        media_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    stdout, _ = await process.communicate()
+    try:
+        return float(stdout.decode().strip())
+    except ValueError:
+        return None
+
+# Función para extraer el audio del video
+async def extract_audio(video_path: str) -> str:
+    """Extrae solo el audio como Opus mono de bajo bitrate y devuelve la ruta del .ogg"""
+    audio_path = make_temp_path(".ogg")
+    try:
+        await run_ffmpeg(
+            "-y", "-i", video_path,
+            "-vn",                              # Descartar video
+            "-ac", "1",                         # Mono
+            "-ar", str(AUDIO_SAMPLE_RATE),
+            "-c:a", "libopus",
+            "-b:a", AUDIO_BITRATE,
+            "-application", "voip",             # Perfil optimizado para voz
+            audio_path,
+        )
+    except Exception:
+        os.unlink(audio_path)
+        raise
+
+    logger.info(
+        f"Audio extraído: {os.path.getsize(video_path)} -> {os.path.getsize(audio_path)} bytes ({audio_path})"
+    )
+    return audio_path
+
+def _to_seconds(match) -> float:
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+# Función para detectar silencios
+async def analyze_silences(audio_path: str, min_duration: float = SILENCE_MIN_DURATION) -> Tuple[float, List[Tuple[float, float]]]:
+    """Devuelve la duración del audio y los intervalos de silencio detectados por ffmpeg (silencedetect)"""
+    output = await run_ffmpeg(
+        "-i", audio_path,
+        "-af", f"silencedetect=noise={SILENCE_THRESHOLD_DB}dB:d={min_duration}",
+        "-f", "null", "-",
+    )
+
+    match = _DURATION_RE.search(output)
+    progress = list(_PROGRESS_TIME_RE.finditer(output))
+    if match:
+        duration = _to_seconds(match)
+    elif progress:
+        duration = _to_seconds(progress[-1])
+    else:
+        raise AudioProcessingError(f"No se pudo determinar la duración de {audio_path}")
+
+    starts = [max(float(value), 0.0) for value in _SILENCE_START_RE.findall(output)]
+    ends = [float(value) for value in _SILENCE_END_RE.findall(output)]
+    # Un silencio que llega hasta el final del archivo no tiene silence_end
+    ends += [duration] * (len(starts) - len(ends))
+    return duration, list(zip(starts, ends))
+
+def plan_chunks(duration: float, silences: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Divide [0, duration] en tramos de ~CHUNK_DURATION cortando en el silencio más tardío disponible"""
+    cuts = [0.0]
+    # Evitar un último fragmento diminuto: solo cortar si sobra más de 1.25 fragmentos
+    while duration - cuts[-1] > CHUNK_DURATION * 1.25:
+        target = cuts[-1] + CHUNK_DURATION
+        earliest = cuts[-1] + CHUNK_DURATION * 0.5
+        candidates = [(start + end) / 2 for start, end in silences if earliest <= (start + end) / 2 <= target]
+        cuts.append(max(candidates) if candidates else target)
+    cuts.append(duration)
+    return list(zip(cuts, cuts[1:]))
+
+async def _cut_chunk(audio_path: str, keep_start: float, keep_end: float, duration: float) -> AudioChunk:
+    start = max(keep_start - CHUNK_OVERLAP, 0.0)
+    end = min(keep_end + CHUNK_OVERLAP, duration)
+    chunk_path = make_temp_path(".ogg")
+    try:
+        await run_ffmpeg(
+            "-y", "-ss", f"{start:.3f}", "-i", audio_path,
+            "-t", f"{end - start:.3f}",
+            "-vn",
+            "-ac", "1",
+            "-ar", str(AUDIO_SAMPLE_RATE),
+            "-c:a", "libopus",
+            "-b:a", AUDIO_BITRATE,
+            "-application", "voip",
+            chunk_path,
+        )
+    except Exception:
+        os.unlink(chunk_path)
+        raise
+    return AudioChunk(chunk_path, start, end, keep_start, keep_end)
+
+# Función para dividir el audio en fragmentos transcribibles en paralelo
+async def split_audio(audio_path: str) -> List[AudioChunk]:
+    """Divide el audio en fragmentos solapados cortando en silencios.
+
+    Devuelve una lista vacía si la grabación es lo bastante corta para una sola petición.
+    """
+    duration, silences = await analyze_silences(audio_path)
+    spans = plan_chunks(duration, silences)
+    if len(spans) < 2:
+        return []
+
+    results = await asyncio.gather(
+        *(_cut_chunk(audio_path, keep_start, keep_end, duration) for keep_start, keep_end in spans),
+        return_exceptions=True,
+    )
+    chunks = [result for result in results if isinstance(result, AudioChunk)]
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for chunk in chunks:
+            os.unlink(chunk.path)
+        raise errors[0]
+
+    logger.info(f"Audio de {duration:.1f}s dividido en {len(chunks)} fragmentos")
+    return chunks
+
+def speech_spans(duration: float, silences: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Tramos con voz: el complemento de los silencios, con VAD_PADDING de margen a cada lado"""
+    spans = []
+    position = 0.0
+    for silence_start, silence_end in silences:
+        # Un silencio al inicio o al final del archivo se elimina completo, sin margen
+        end = min(silence_start + VAD_PADDING, duration) if silence_start > 0 else 0.0
+        if end > position:
+            spans.append((position, end))
+        position = duration if silence_end >= duration else max(silence_end - VAD_PADDING, position)
+    if duration > position:
+        spans.append((position, duration))
+
+    # Unir tramos que el margen dejó pegados o solapados
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+# Función para eliminar silencios largos antes de transcribir
+async def trim_silence(audio_path: str) -> Optional[Tuple[str, TimeMap]]:
+    """Elimina las pausas largas y devuelve (ruta del audio recortado, mapa de tiempos).
+
+    Devuelve None si no hay silencio suficiente como para que valga la pena recortar.
+    """
+    duration, silences = await analyze_silences(audio_path, min_duration=VAD_MIN_SILENCE)
+    spans = speech_spans(duration, silences)
+    time_map = TimeMap(spans)
+    if not spans or duration - time_map.trimmed_duration < VAD_MIN_SAVINGS:
+        return None
+
+    selection = "+".join(f"between(t,{start:.3f},{end:.3f})" for start, end in spans)
+    trimmed_path = make_temp_path(".ogg")
+    try:
+        await run_ffmpeg(
+            "-y", "-i", audio_path,
+            "-vn",
+            "-af", f"aselect='{selection}',asetpts=N/SR/TB",
+            "-ac", "1",
+            "-ar", str(AUDIO_SAMPLE_RATE),
+            "-c:a", "libopus",
+            "-b:a", AUDIO_BITRATE,
+            "-application", "voip",
+            trimmed_path,
+        )
+    except Exception:
+        os.unlink(trimmed_path)
+        raise
+
+    logger.info(f"Silencios recortados: {duration:.1f}s -> {time_map.trimmed_duration:.1f}s")
+    return trimmed_path, time_map
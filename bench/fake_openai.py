@@ -0,0 +1,66 @@
+"""Servidor HTTP que imita POST /v1/audio/transcriptions de OpenAI para el benchmark.
+
+Uso:
+    uvicorn bench.fake_openai:app --port 8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=bench ...
+"""
+import os
+import asyncio
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Latencia simulada: base log-normal más un costo por MB subido
+FAKE_LATENCY_MEDIAN = float(os.getenv("FAKE_OPENAI_LATENCY_MEDIAN", "0.8"))
+FAKE_LATENCY_SIGMA = float(os.getenv("FAKE_OPENAI_LATENCY_SIGMA", "0.4"))
+FAKE_SECONDS_PER_MB = float(os.getenv("FAKE_OPENAI_SECONDS_PER_MB", "0.5"))
+FAKE_BYTES_PER_SECOND = float(os.getenv("FAKE_OPENAI_BYTES_PER_SECOND", "3000"))  # Para estimar la duración del audio
+FAKE_RATE_LIMIT_RATE = float(os.getenv("FAKE_OPENAI_RATE_LIMIT_RATE", "0"))
+
+app = FastAPI(title="Fake OpenAI Transcriptions")
+rng = random.Random(int(os.getenv("FAKE_OPENAI_SEED", "7")))
+stats = {"requests": 0, "bytes": 0, "rate_limited": 0}
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    """Responde en formato verbose_json con segmentos de ~4 s según el tamaño del archivo subido"""
+    body = await request.body()
+    stats["requests"] += 1
+    stats["bytes"] += len(body)
+
+    latency = rng.lognormvariate(0, FAKE_LATENCY_SIGMA) * FAKE_LATENCY_MEDIAN
+    latency += len(body) / (1024 * 1024) * FAKE_SECONDS_PER_MB
+    await asyncio.sleep(latency)
+
+    if rng.random() < FAKE_RATE_LIMIT_RATE:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+        )
+
+    duration = max(len(body) / FAKE_BYTES_PER_SECOND, 1.0)
+    segments = []
+    position = 0.0
+    while position < duration:
+        end = min(position + 4.0, duration)
+        segments.append({
+            "id": len(segments),
+            "start": round(position, 3),
+            "end": round(end, 3),
+            "text": f" Segmento de prueba número {len(segments) + 1}.",
+        })
+        position = end
+
+    return {
+        "task": "transcribe",
+        "language": "spanish",
+        "duration": round(duration, 3),
+        "text": "".join(seg["text"] for seg in segments).strip(),
+        "segments": segments,
+    }
+
+@app.get("/stats")
+async def get_stats():
+    return stats
@@ -0,0 +1,172 @@
+"""Benchmark de punta a punta del worker contra PostgreSQL local y un OpenAI falso.
+
+Para cada nivel de concurrencia levanta un proceso nuevo que procesa todas las respuestas
+sembradas por bench.seed con process_video. Reporta jobs/s, percentiles de latencia por etapa
+(fetch, claim, stream, decode, temp_write, audio, transcribe, write) y el RSS máximo del proceso.
+
+Uso:
+    python -m bench.seed --count 40
+    python -m bench.run --concurrency 1,4,8,16
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STAGES = ["fetch", "claim", "stream", "decode", "temp_write", "audio", "transcribe", "write"]
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+async def run_level(concurrency: int, limit: int) -> dict:
+    """Procesa las respuestas de benchmark con `concurrency` jobs simultáneos (en este proceso)"""
+    import main  # Carga .env antes de que db lea DB_*
+    import db
+
+    timings = {stage: [] for stage in STAGES}
+    main.stage_observers.append(lambda stage, seconds: timings.setdefault(stage, []).append(seconds))
+
+    await db.db_pool.open()
+    async with db.db_pool.connection() as conn:
+        # Dejar las filas de benchmark como recién sembradas, sin transcripción previa
+        cur = await conn.execute("""
+            UPDATE responses
+            SET processing_status = 'seeded',
+                data = data - 'transcript' - 'timestamped_transcript' - 'transcription_method'
+                            - 'transcribed_at' - 'transcription_error' - 'transcription_failed_at'
+            WHERE data ? 'bench'
+            RETURNING id
+        """)
+        response_ids = [str(row[0]) for row in await cur.fetchall()][:limit or None]
+        await conn.execute("""
+            DELETE FROM transcription_jobs j
+            USING responses r
+            WHERE r.id = j.response_id AND r.data ? 'bench'
+        """)
+        await conn.commit()
+
+    slots = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def job(response_id: str):
+        nonlocal failures
+        async with slots:
+            try:
+                await main.process_video(response_id)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(job(response_id) for response_id in response_ids))
+    elapsed = time.perf_counter() - started
+    await db.db_pool.close()
+
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / 1024 if sys.platform != "darwin" else peak_rss / (1024 * 1024)
+
+    return {
+        "concurrency": concurrency,
+        "jobs": len(response_ids),
+        "failed": failures,
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(len(response_ids) / elapsed, 3) if elapsed else 0.0,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "stages": {
+            stage: {
+                "p50": round(percentile(values, 0.50), 4),
+                "p95": round(percentile(values, 0.95), 4),
+                "p99": round(percentile(values, 0.99), 4),
+                "count": len(values),
+            }
+            for stage, values in timings.items()
+        },
+    }
+
+def wait_for_server(url: str, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"El servidor falso de OpenAI no respondió en {url}")
+
+def print_report(results: list):
+    print(f"{'conc':>5} {'jobs':>5} {'fail':>5} {'jobs/s':>8} {'rss MB':>8}  " + "  ".join(f"{stage + ' p50/p95':>20}" for stage in STAGES))
+    for result in results:
+        stages = "  ".join(
+            f"{result['stages'].get(stage, {}).get('p50', 0):>9.3f}/{result['stages'].get(stage, {}).get('p95', 0):<10.3f}"
+            for stage in STAGES
+        )
+        print(
+            f"{result['concurrency']:>5} {result['jobs']:>5} {result['failed']:>5} "
+            f"{result['jobs_per_second']:>8.2f} {result['peak_rss_mb']:>8.1f}  {stages}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,8,16", help="Niveles de concurrencia separados por coma")
+    parser.add_argument("--limit", type=int, default=0, help="Máximo de respuestas por nivel (0 = todas)")
+    parser.add_argument("--port", type=int, default=8765, help="Puerto del servidor falso de OpenAI")
+    parser.add_argument("--output", help="Archivo donde guardar los resultados en JSON")
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)  # Uso interno: ejecutar un solo nivel
+    args = parser.parse_args()
+
+    if args.level:
+        print(json.dumps(asyncio.run(run_level(args.level, args.limit))))
+        return
+
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.port}/v1",
+        OPENAI_API_KEY="bench",
+        TRANSCRIPTION_ENGINE="openai",
+        TRANSCRIPT_CACHE_ENABLED="false",  # Cada nivel debe pagar la transcripción completa
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench.fake_openai:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    try:
+        wait_for_server(f"http://127.0.0.1:{args.port}/stats")
+        results = []
+        for concurrency in [int(value) for value in args.concurrency.split(",")]:
+            # Un proceso por nivel para que el RSS máximo sea el de ese nivel; salvo que se fije
+            # explícitamente, el límite de transcripciones simultáneas acompaña al nivel
+            level_env = dict(env)
+            level_env.setdefault("TRANSCRIPTION_CONCURRENCY", str(concurrency))
+            output = subprocess.run(
+                [sys.executable, "-m", "bench.run", "--level", str(concurrency), "--limit", str(args.limit)],
+                cwd=ROOT,
+                env=level_env,
+                check=True,
+                stdout=subprocess.PIPE,
+                text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Siembra una base PostgreSQL LOCAL con respuestas de video para el benchmark.
+
+Usa las mismas variables DB_* que el worker. Crea las tablas mínimas si no existen,
+aplica en orden las migraciones de migrations/ que falten (registradas en
+schema_migrations, así cada una corre una sola vez) y marca todas sus filas con
+data.bench = true: el benchmark solo toca esas filas.
+
+Uso:
+    python -m bench.seed --count 40 --durations 10,30,60,120
+"""
+import os
+import sys
+import glob
+import uuid
+import base64
+import argparse
+import subprocess
+import tempfile
+
+import psycopg
+from psycopg.types.json import Jsonb
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+load_dotenv()
+
+from db import DB_CONFIG  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id UUID PRIMARY KEY,
+    type TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS responses (
+    id UUID PRIMARY KEY,
+    question_id UUID NOT NULL REFERENCES questions (id),
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    processing_status TEXT NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+MIGRATIONS_DIR = os.path.join(ROOT, "migrations")
+
+# Bitrate aproximado de un video webm grabado desde el navegador (bytes por segundo)
+FALLBACK_BYTES_PER_SECOND = 60_000
+
+def make_video(duration: int) -> bytes:
+    """Genera un webm con video de prueba y voz sintética (tono modulado); sin ffmpeg, bytes aleatorios"""
+    fd, path = tempfile.mkstemp(suffix=".webm")
+    os.close(fd)
+    try:
+        subprocess.run(
+            [
+                "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+                "-f", "lavfi", "-i", "testsrc=size=640x360:rate=24",
+                "-f", "lavfi", "-i", "sine=frequency=220:beep_factor=4",
+                "-t", str(duration),
+                "-c:v", "libvpx", "-b:v", "400k",
+                "-c:a", "libopus", "-b:a", "48k",
+                path,
+            ],
+            check=True,
+        )
+        with open(path, "rb") as video_file:
+            return video_file.read()
+    except (OSError, subprocess.CalledProcessError):
+        return os.urandom(duration * FALLBACK_BYTES_PER_SECOND)
+    finally:
+        os.unlink(path)
+
+def apply_migrations(conn: psycopg.Connection):
+    """Aplica en orden las migraciones que aún no figuran en schema_migrations.
+
+    La conexión va en autocommit: cada archivo se envía en una sola consulta (una transacción
+    implícita) y así 002 puede usar CREATE INDEX CONCURRENTLY.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            filename TEXT PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    applied = {row[0] for row in conn.execute("SELECT filename FROM schema_migrations")}
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        filename = os.path.basename(path)
+        if filename in applied:
+            continue
+        with open(path) as migration:
+            conn.execute(migration.read())
+        conn.execute("INSERT INTO schema_migrations (filename) VALUES (%s)", (filename,))
+        print(f"Migración aplicada: {filename}")
+
+def seed(count: int, durations: list):
+    videos = {duration: base64.b64encode(make_video(duration)).decode() for duration in durations}
+    with psycopg.connect(**DB_CONFIG, autocommit=True) as conn:
+        conn.execute(SCHEMA)
+        apply_migrations(conn)
+        question_id = uuid.uuid4()
+        conn.execute("INSERT INTO questions (id, type) VALUES (%s, 'video')", (question_id,))
+        for index in range(count):
+            duration = durations[index % len(durations)]
+            data = {
+                "bench": True,
+                "bench_duration": duration,
+                "response": {"type": "video", "data": f"data:video/webm;base64,{videos[duration]}"},
+            }
+            conn.execute(
+                "INSERT INTO responses (id, question_id, data, processing_status) VALUES (%s, %s, %s, 'seeded')",
+                (uuid.uuid4(), question_id, Jsonb(data)),
+            )
+    sizes = ", ".join(f"{duration}s={len(video) // 1024} KiB" for duration, video in videos.items())
+    print(f"Sembradas {count} respuestas de benchmark ({sizes})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--durations", default="10,30,60,120", help="Duraciones de video en segundos, separadas por coma")
+    args = parser.parse_args()
+    seed(args.count, [int(value) for value in args.durations.split(",")])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Optional
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la caché de transcripciones (clave: hash del video decodificado)
+TRANSCRIPT_CACHE_ENABLED = os.getenv("TRANSCRIPT_CACHE_ENABLED", "true").lower() == "true"
+TRANSCRIPT_CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", "/tmp/transcript_cache.sqlite3")
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+TRANSCRIPT_CACHE_SHARED = os.getenv("TRANSCRIPT_CACHE_SHARED", "true").lower() == "true"
+# Retención de la tabla compartida: se borran las entradas sin usar hace más de estos días
+TRANSCRIPT_CACHE_SHARED_MAX_AGE_DAYS = float(os.getenv("TRANSCRIPT_CACHE_SHARED_MAX_AGE_DAYS", "90"))
+TRANSCRIPT_CACHE_PRUNE_INTERVAL = float(os.getenv("TRANSCRIPT_CACHE_PRUNE_INTERVAL", "3600"))  # Segundos
+
+class LocalTranscriptCache:
+    """Caché SQLite en disco local con desalojo LRU por tamaño total"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    cache_key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS transcripts_last_used_idx ON transcripts (last_used)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, cache_key: str) -> Optional[dict]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT payload FROM transcripts WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE transcripts SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key))
+            conn.commit()
+            return json.loads(row[0])
+
+    def put(self, cache_key: str, entry: dict):
+        payload = json.dumps(entry)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO transcripts (cache_key, payload, size, last_used) VALUES (?, ?, ?, ?)",
+                (cache_key, payload, len(payload), time.time()),
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Borra las entradas usadas hace más tiempo hasta quedar bajo max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM transcripts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for cache_key, size in conn.execute("SELECT cache_key, size FROM transcripts ORDER BY last_used").fetchall():
+            conn.execute("DELETE FROM transcripts WHERE cache_key = ?", (cache_key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+class TranscriptCache:
+    """Caché de dos niveles: SQLite local y tabla compartida en PostgreSQL"""
+
+    def __init__(self, local: LocalTranscriptCache, shared: bool):
+        self.local = local
+        self.shared = shared
+        self.stats = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+        self._last_prune = 0.0
+
+    async def get(self, cache_key: str) -> Optional[dict]:
+        """Busca la transcripción en el nivel local y luego en el compartido; nunca lanza"""
+        try:
+            entry = await asyncio.to_thread(self.local.get, cache_key)
+            if entry is not None:
+                self.stats["local_hits"] += 1
+                return entry
+
+            if self.shared:
+                entry = await db.get_cached_transcript(cache_key)
+                if entry is not None:
+                    self.stats["shared_hits"] += 1
+                    await asyncio.to_thread(self.local.put, cache_key, entry)
+                    return entry
+        except Exception as e:
+            logger.warning(f"Error leyendo caché de transcripciones: {str(e)}")
+
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, cache_key: str, text: str, segments: list):
+        """Guarda la transcripción en ambos niveles; un error no afecta al procesamiento"""
+        entry = {"text": text, "segments": segments}
+        try:
+            await asyncio.to_thread(self.local.put, cache_key, entry)
+            if self.shared:
+                await db.store_cached_transcript(cache_key, text, segments)
+        except Exception as e:
+            logger.warning(f"Error guardando en caché de transcripciones: {str(e)}")
+
+    async def prune(self):
+        """Poda la tabla compartida cada TRANSCRIPT_CACHE_PRUNE_INTERVAL segundos (el nivel local ya es LRU)"""
+        if not self.shared or TRANSCRIPT_CACHE_SHARED_MAX_AGE_DAYS <= 0:
+            return
+        now = time.monotonic()
+        if self._last_prune and now - self._last_prune < TRANSCRIPT_CACHE_PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        try:
+            deleted = await db.prune_transcript_cache(TRANSCRIPT_CACHE_SHARED_MAX_AGE_DAYS)
+            if deleted:
+                logger.info(f"Caché compartida: {deleted} transcripciones sin usar eliminadas")
+        except Exception as e:
+            logger.warning(f"Error podando la caché compartida de transcripciones: {str(e)}")
+
+transcript_cache = TranscriptCache(
+    LocalTranscriptCache(TRANSCRIPT_CACHE_PATH, TRANSCRIPT_CACHE_MAX_BYTES),
+    shared=TRANSCRIPT_CACHE_SHARED,
+)
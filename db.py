@@ -0,0 +1,739 @@
+import os
+import asyncio
+import time
+import logging
+import socket
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+import tracing
+from lanes import JOB_LANES
+
+logger = logging.getLogger(__name__)
+
+# Configuración de PostgreSQL
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT", "5432"),
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "connect_timeout": 30,  # Timeout de conexión
+    "sslmode": os.getenv("DB_SSLMODE", "prefer"),  # SSL opcional por defecto
+}
+
+# Configuración del pool de conexiones
+DB_POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    "max_idle": float(os.getenv("DB_POOL_MAX_IDLE_TIME", "300")),  # Segundos antes de cerrar una ociosa sobre min_size
+    "check_after": float(os.getenv("DB_POOL_CHECK_AFTER", "30")),  # Segundos ociosa antes de verificar en checkout
+    "checkout_timeout": float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "30")),
+    "reconnect_timeout": float(os.getenv("DB_POOL_RECONNECT_TIMEOUT", "300")),  # Segundos reintentando antes de rendirse
+}
+
+# Cola durable de jobs (migrations/004_transcription_jobs.sql)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "30"))  # Segundos; se duplica en cada intento
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "1800"))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"  # Dueño de los jobs tomados
+JOB_LEASE_DURATION = float(os.getenv("JOB_LEASE_DURATION", "120"))  # Segundos; el heartbeat lo renueva
+
+class DatabasePool:
+    """Pool asíncrono y acotado de conexiones PostgreSQL compartido por todo el worker.
+
+    Envuelve un psycopg_pool.AsyncConnectionPool: él abre las conexiones en segundo plano (con
+    reintentos y backoff mientras la base esté caída), acota la espera de cada checkout con
+    `timeout` y cierra las ociosas sobrantes tras `max_idle` segundos. El pool real se crea dentro
+    del event loop de uvicorn, al abrirlo o en el primer uso.
+    """
+
+    def __init__(self, conninfo: dict, min_size: int, max_size: int, max_idle: float,
+                 check_after: float, checkout_timeout: float, reconnect_timeout: float):
+        self.conninfo = conninfo
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.checkout_timeout = checkout_timeout
+        self.reconnect_timeout = reconnect_timeout
+
+        self._pool: Optional[AsyncConnectionPool] = None
+        # Instante en que cada conexión volvió al pool, para verificar solo las que llevan rato ociosas
+        self._returned_at = weakref.WeakKeyDictionary()
+        self.stats = {"failed_health_checks": 0}
+
+    async def _check(self, conn: psycopg.AsyncConnection):
+        """Verifica con SELECT 1 las conexiones ociosas hace más de check_after segundos"""
+        returned_at = self._returned_at.get(conn)
+        if returned_at is None or time.monotonic() - returned_at < self.check_after:
+            return
+        try:
+            await AsyncConnectionPool.check_connection(conn)
+        except Exception:
+            self.stats["failed_health_checks"] += 1
+            logger.warning("Discarding unhealthy pooled database connection")
+            raise
+
+    async def _mark_returned(self, conn: psycopg.AsyncConnection):
+        self._returned_at[conn] = time.monotonic()
+
+    async def open(self, wait: bool = True):
+        """Abre el pool; con `wait` espera a tener min_size conexiones (hasta checkout_timeout)"""
+        if self._pool is None:
+            self._pool = AsyncConnectionPool(
+                kwargs=self.conninfo,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                max_idle=self.max_idle,
+                timeout=self.checkout_timeout,
+                reconnect_timeout=self.reconnect_timeout,
+                check=self._check,
+                reset=self._mark_returned,
+                name="transcription-worker",
+                open=False,
+            )
+        await self._pool.open(wait=wait, timeout=self.checkout_timeout)
+
+    @asynccontextmanager
+    async def connection(self):
+        """Context manager: toma una conexión y la devuelve siempre al pool"""
+        if self._pool is None:
+            await self.open(wait=False)
+        # La espera por una conexión libre queda en su propio span
+        with tracing.tracer.start_as_current_span("db.pool.checkout"):
+            conn = await self._pool.getconn()
+        try:
+            yield conn
+        finally:
+            # El pool deshace la transacción abierta y descarta la conexión si quedó rota
+            await self._pool.putconn(conn)
+
+    async def close(self):
+        """Cerrar todas las conexiones y rechazar nuevos checkouts"""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
+
+    def metrics(self) -> dict:
+        """Métricas del pool para /health"""
+        pool_stats = self._pool.get_stats() if self._pool is not None else {}
+        size = pool_stats.get("pool_size", 0)
+        idle = pool_stats.get("pool_available", 0)
+        return {
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiting": pool_stats.get("requests_waiting", 0),
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "connections_created": pool_stats.get("connections_num", 0),
+            "connect_errors": pool_stats.get("connections_errors", 0),
+            "connections_lost": pool_stats.get("connections_lost", 0),
+            "checkouts": pool_stats.get("requests_num", 0),
+            "checkout_errors": pool_stats.get("requests_errors", 0),
+            "returned_broken": pool_stats.get("returns_bad", 0),
+            **self.stats,
+        }
+
+db_pool = DatabasePool(DB_CONFIG, **DB_POOL_CONFIG)
+
+# Canal NOTIFY alimentado por el trigger de migrations/001_notify_pending_responses.sql
+JOBS_CHANNEL = "transcription_jobs"
+
+@asynccontextmanager
+async def job_notifications():
+    """Conexión dedicada (fuera del pool) suscrita al canal de trabajos; entrega el iterador de avisos"""
+    conn = await psycopg.AsyncConnection.connect(**DB_CONFIG, autocommit=True)
+    try:
+        await conn.execute(f"LISTEN {JOBS_CHANNEL}")
+        yield conn.notifies()
+    finally:
+        await conn.close()
+
+# Atributos comunes de los spans de consultas
+DB_SPAN_ATTRIBUTES = {"db.system": "postgresql"}
+
+# Verificar conectividad con la base
+@tracing.traced("db.ping", DB_SPAN_ATTRIBUTES)
+async def ping() -> bool:
+    """Ejecuta SELECT 1 con una conexión del pool"""
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("SELECT 1")
+        return await cur.fetchone() is not None
+
+# Función para obtener respuesta de la base de datos
+@tracing.traced("db.get_response_data", DB_SPAN_ATTRIBUTES)
+async def get_response_data(response_id: str) -> Optional[dict]:
+    """Obtener de PostgreSQL solo los metadatos necesarios para procesar la respuesta.
+
+    Devuelve id, question_type, la longitud del video base64 (data.response.data), la posición
+    (1-based) donde empieza el base64 tras un prefijo data:video/...;base64, y si la fila usa el
+    formato antiguo video_url. El video en sí se lee después con stream_video_payload.
+    """
+    async with db_pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("""
+                WITH payload AS MATERIALIZED (
+                    SELECT r.id,
+                           r.question_id,
+                           r.data->'response'->>'data' AS video_data,
+                           jsonb_typeof(r.data->'response') IS DISTINCT FROM 'object'
+                               AND r.data ? 'video_url' AS has_video_url
+                    FROM responses r
+                    WHERE r.id = %s
+                )
+                SELECT p.id,
+                       q.type AS question_type,
+                       octet_length(p.video_data) AS video_data_length,
+                       CASE WHEN left(p.video_data, 10) = 'data:video'
+                            THEN position(',' IN p.video_data) + 1
+                            ELSE 1
+                       END AS video_data_start,
+                       p.has_video_url
+                FROM payload p
+                JOIN questions q ON p.question_id = q.id
+            """, (response_id,))
+            return await cur.fetchone()
+
+# Tamaño de los fragmentos base64 leídos desde el cursor (múltiplo de 4)
+VIDEO_CHUNK_SIZE = int(os.getenv("VIDEO_CHUNK_SIZE", str(1024 * 1024)))
+
+# Función para leer el video base64 por fragmentos
+async def stream_video_payload(response_id: str, start: int = 1, chunk_size: int = VIDEO_CHUNK_SIZE):
+    """Itera el video base64 en fragmentos de `chunk_size` caracteres desde un cursor de servidor.
+
+    El documento se extrae una sola vez en PostgreSQL y el cliente solo retiene unos pocos fragmentos.
+    """
+    async with db_pool.connection() as conn:
+        async with conn.cursor(name=f"video_payload_{uuid.uuid4().hex}") as cur:
+            cur.itersize = 2
+            await cur.execute("""
+                WITH payload AS MATERIALIZED (
+                    SELECT data->'response'->>'data' AS video_data
+                    FROM responses
+                    WHERE id = %(response_id)s
+                )
+                SELECT substring(p.video_data FROM offs FOR %(chunk_size)s)
+                FROM payload p,
+                     generate_series(%(start)s, length(p.video_data), %(chunk_size)s) AS offs
+                ORDER BY offs
+            """, {"response_id": response_id, "start": start, "chunk_size": chunk_size})
+            async for (chunk,) in cur:
+                yield chunk
+
+# Función para reclamar una respuesta concreta
+@tracing.traced("db.claim_response", DB_SPAN_ATTRIBUTES)
+async def claim_response(response_id: str, engine: Optional[str] = None, reprocess: bool = False) -> bool:
+    """Crea o toma el job de la respuesta y la marca como 'processing'; False si otro worker ya lo tiene.
+
+    Un job muerto vuelve a empezar desde el intento 1; uno terminado solo con `reprocess` (si no,
+    devuelve False y el video no se vuelve a transcribir).
+    """
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("""
+            WITH job AS (
+                INSERT INTO transcription_jobs AS j
+                    (response_id, status, engine, attempts, lease_owner, leased_at, lease_expires_at)
+                VALUES (%(response_id)s, 'running', %(engine)s, 1, %(owner)s, CURRENT_TIMESTAMP,
+                        CURRENT_TIMESTAMP + make_interval(secs => %(lease)s))
+                ON CONFLICT (response_id) DO UPDATE
+                SET status = 'running',
+                    engine = COALESCE(EXCLUDED.engine, j.engine),
+                    attempts = CASE WHEN j.status IN ('completed', 'dead') THEN 1 ELSE j.attempts + 1 END,
+                    lease_owner = EXCLUDED.lease_owner,
+                    leased_at = EXCLUDED.leased_at,
+                    lease_expires_at = EXCLUDED.lease_expires_at,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE j.status <> 'running'
+                AND (j.status <> 'completed' OR %(reprocess)s)
+                RETURNING j.response_id
+            )
+            UPDATE responses r
+            SET processing_status = 'processing',
+                updated_at = CURRENT_TIMESTAMP
+            FROM job
+            WHERE r.id = job.response_id
+            RETURNING r.id
+        """, {
+            "response_id": response_id,
+            "engine": engine,
+            "owner": WORKER_ID,
+            "lease": JOB_LEASE_DURATION,
+            "reprocess": reprocess,
+        })
+        claimed = await cur.fetchone() is not None
+        await conn.commit()
+        return claimed
+
+# Función para actualizar respuesta con transcripción
+@tracing.traced("db.update_response_with_transcript", DB_SPAN_ATTRIBUTES)
+async def update_response_with_transcript(response_id: str, transcript: str, segments: list,
+                                          method: str = "openai_whisper") -> bool:
+    """Actualizar respuesta con transcripción en PostgreSQL y cerrar su job.
+
+    El parche se fusiona en el servidor (data || patch): no se lee ni se reescribe el video base64.
+    Solo escribe si el job sigue en curso: si otro worker ya lo completó (por ejemplo tras perder
+    el lease), devuelve False y no pisa su resultado.
+    """
+    patch = {
+        "transcript": transcript,
+        "timestamped_transcript": segments,
+        "transcription_method": method,
+        "transcribed_at": datetime.utcnow().isoformat(),
+    }
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("""
+            WITH job AS (
+                UPDATE transcription_jobs
+                SET status = 'completed',
+                    last_error = NULL,
+                    lease_owner = NULL,
+                    lease_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE response_id = %(response_id)s
+                AND status = 'running'
+                RETURNING response_id
+            )
+            UPDATE responses r
+            SET data = COALESCE(r.data, '{}'::jsonb) || %(patch)s,
+                processing_status = 'completed',
+                updated_at = CURRENT_TIMESTAMP
+            FROM job
+            WHERE r.id = job.response_id
+            RETURNING r.id
+        """, {"patch": Jsonb(patch), "response_id": response_id})
+        written = await cur.fetchone() is not None
+        await conn.commit()
+        return written
+
+# Función para registrar el fallo de un job
+@tracing.traced("db.fail_job", DB_SPAN_ATTRIBUTES)
+async def fail_job(response_id: str, error: str, transient: bool) -> Optional[dict]:
+    """Devuelve el job de este worker a la cola con backoff exponencial y jitter, o lo pasa a 'dead'.
+
+    Los errores transitorios se reintentan hasta JOB_MAX_ATTEMPTS intentos; los permanentes van
+    directo a 'dead'. Un job re-encolado deja la respuesta en 'pending'. Devuelve status, attempts
+    y next_run_at del job, o None si el job no está tomado por este worker.
+    """
+    async with db_pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("""
+                WITH job AS (
+                    UPDATE transcription_jobs
+                    SET status = CASE WHEN %(transient)s AND attempts < %(max_attempts)s
+                                      THEN 'queued' ELSE 'dead' END,
+                        lane = 'retry',
+                        next_run_at = CURRENT_TIMESTAMP + make_interval(secs =>
+                            LEAST(%(max_delay)s, %(base_delay)s * power(2, attempts - 1)) * (0.5 + random())),
+                        last_error = %(error)s,
+                        lease_owner = NULL,
+                        leased_at = NULL,
+                        lease_expires_at = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE response_id = %(response_id)s
+                    AND status = 'running'
+                    AND lease_owner = %(owner)s
+                    RETURNING response_id, status, attempts, next_run_at
+                ),
+                requeued AS (
+                    UPDATE responses r
+                    SET processing_status = 'pending',
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM job
+                    WHERE r.id = job.response_id
+                    AND job.status = 'queued'
+                )
+                SELECT status, attempts, next_run_at FROM job
+            """, {
+                "response_id": response_id,
+                "error": error,
+                "transient": transient,
+                "max_attempts": JOB_MAX_ATTEMPTS,
+                "base_delay": JOB_RETRY_BASE_DELAY,
+                "max_delay": JOB_RETRY_MAX_DELAY,
+                "owner": WORKER_ID,
+            })
+            row = await cur.fetchone()
+        await conn.commit()
+        return row
+
+# Agrupación de fallos: muchos jobs fallando a la vez se escriben en un solo round-trip
+FAILURE_BATCH_WINDOW = float(os.getenv("FAILURE_BATCH_WINDOW", "0.1"))  # Segundos
+FAILURE_BATCH_MAX = int(os.getenv("FAILURE_BATCH_MAX", "50"))
+
+class FailureBatcher:
+    """Acumula marcados de fallo concurrentes y los escribe juntos con un parche JSONB en el servidor"""
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._pending = []  # Lista de (response_id, patch, future)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()
+
+    async def submit(self, response_id: str, error: str):
+        """Encola el fallo y espera a que el lote que lo contiene quede guardado"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        patch = {
+            "transcription_error": error,
+            "transcription_failed_at": datetime.utcnow().isoformat(),
+        }
+        self._pending.append((response_id, patch, future))
+        if len(self._pending) >= self.max_size:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush_pending)
+        await future
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._write(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: list):
+        try:
+            async with db_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    # executemany usa pipeline: todas las sentencias viajan en un único round-trip
+                    await cur.executemany("""
+                        UPDATE responses
+                        SET data = COALESCE(data, '{}'::jsonb) || %s,
+                            processing_status = 'failed',
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = %s
+                    """, [(Jsonb(patch), response_id) for response_id, patch, _ in batch])
+                await conn.commit()
+            if len(batch) > 1:
+                logger.info(f"Marcadas {len(batch)} respuestas como fallidas en un solo lote")
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+failure_batcher = FailureBatcher(FAILURE_BATCH_WINDOW, FAILURE_BATCH_MAX)
+
+# Función para marcar respuesta como fallida
+@tracing.traced("db.mark_response_as_failed", DB_SPAN_ATTRIBUTES)
+async def mark_response_as_failed(response_id: str, error: str):
+    """Marcar respuesta como fallida en PostgreSQL (sin releer el video; agrupado con otros fallos)"""
+    await failure_batcher.submit(response_id, error)
+
+# Función para encolar jobs de respuestas
+@tracing.traced("db.enqueue_jobs", DB_SPAN_ATTRIBUTES)
+async def enqueue_jobs(response_ids: list, engine: Optional[str] = None, lane: str = "webhook",
+                       trace_context: Optional[dict] = None, reprocess: bool = False) -> dict:
+    """Valida y encola en una sola sentencia (una transacción) los jobs de varias respuestas de video.
+
+    Un job en espera pasa a este carril y vence ya; uno muerto se reinicia; uno en curso no se
+    toca. Uno terminado solo se reinicia con `reprocess` (un webhook duplicado no vuelve a
+    transcribir). Las respuestas encoladas quedan 'pending'. Devuelve {response_id: "queued" |
+    "already_processing" | "already_completed"} solo para los ids que existen y son de video
+    (UUID en minúsculas).
+    """
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("""
+            WITH target AS (
+                SELECT r.id
+                FROM responses r
+                JOIN questions q ON q.id = r.question_id
+                WHERE r.id = ANY(%(response_ids)s::uuid[])
+                AND q.type = 'video'
+            ),
+            existing AS (
+                SELECT response_id, status
+                FROM transcription_jobs
+                WHERE response_id IN (SELECT id FROM target)
+            ),
+            job AS (
+                INSERT INTO transcription_jobs AS j (response_id, engine, lane, trace_context)
+                SELECT id, %(engine)s, %(lane)s, %(trace_context)s
+                FROM target
+                ORDER BY id  -- Mismo orden de bloqueo en lotes concurrentes
+                ON CONFLICT (response_id) DO UPDATE
+                SET status = 'queued',
+                    lane = EXCLUDED.lane,
+                    engine = COALESCE(EXCLUDED.engine, j.engine),
+                    trace_context = EXCLUDED.trace_context,
+                    attempts = CASE WHEN j.status IN ('completed', 'dead') THEN 0 ELSE j.attempts END,
+                    next_run_at = CURRENT_TIMESTAMP,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE j.status <> 'running'
+                AND (j.status <> 'completed' OR %(reprocess)s)
+                RETURNING j.response_id
+            ),
+            pending AS (
+                UPDATE responses r
+                SET processing_status = 'pending',
+                    updated_at = CURRENT_TIMESTAMP
+                FROM job
+                WHERE r.id = job.response_id
+            )
+            SELECT target.id::text,
+                   CASE
+                       WHEN job.response_id IS NOT NULL THEN 'queued'
+                       WHEN existing.status = 'completed' THEN 'already_completed'
+                       ELSE 'already_processing'
+                   END
+            FROM target
+            LEFT JOIN job ON job.response_id = target.id
+            LEFT JOIN existing ON existing.response_id = target.id
+        """, {
+            "response_ids": list(dict.fromkeys(response_ids)),
+            "engine": engine,
+            "lane": lane,
+            "trace_context": Jsonb(trace_context) if trace_context else None,
+            "reprocess": reprocess,
+        })
+        rows = await cur.fetchall()
+        await conn.commit()
+        return dict(rows)
+
+# Función para reclamar jobs pendientes de un carril
+@tracing.traced("db.claim_pending_jobs", DB_SPAN_ATTRIBUTES)
+async def claim_pending_jobs(limit: int, lane: str) -> list:
+    """Toma hasta `limit` jobs vencidos del carril y marca sus respuestas como 'processing'.
+
+    SKIP LOCKED ignora los jobs que otra réplica está reclamando en ese momento, así que cada
+    job lo toma un único worker. Devuelve, en orden de next_run_at, un dict por job con
+    response_id, engine, lane, wait_seconds (espera desde que venció) y trace_context.
+    """
+    async with db_pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("""
+                WITH due AS (
+                    SELECT response_id
+                    FROM transcription_jobs
+                    WHERE status = 'queued'
+                    AND lane = %(lane)s
+                    AND next_run_at <= CURRENT_TIMESTAMP
+                    ORDER BY next_run_at
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                ),
+                job AS (
+                    UPDATE transcription_jobs j
+                    SET status = 'running',
+                        attempts = j.attempts + 1,
+                        lease_owner = %(owner)s,
+                        leased_at = CURRENT_TIMESTAMP,
+                        lease_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s),
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM due
+                    WHERE j.response_id = due.response_id
+                    RETURNING j.response_id, j.engine, j.lane, j.next_run_at, j.trace_context
+                )
+                UPDATE responses r
+                SET processing_status = 'processing',
+                    updated_at = CURRENT_TIMESTAMP
+                FROM job
+                WHERE r.id = job.response_id
+                RETURNING r.id::text AS response_id, job.engine, job.lane, job.trace_context,
+                          EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - job.next_run_at)::float AS wait_seconds
+            """, {"limit": limit, "lane": lane, "owner": WORKER_ID, "lease": JOB_LEASE_DURATION})
+            rows = await cur.fetchall()
+        await conn.commit()
+        return sorted(rows, key=lambda row: -row["wait_seconds"])
+
+# Función para renovar los leases de los jobs en curso
+@tracing.traced("db.extend_leases", DB_SPAN_ATTRIBUTES)
+async def extend_leases(response_ids: list) -> set:
+    """Heartbeat: extiende en una sola sentencia los leases de este worker; devuelve los que sigue teniendo"""
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("""
+            UPDATE transcription_jobs
+            SET lease_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease)s)
+            WHERE response_id = ANY(%(response_ids)s::uuid[])
+            AND status = 'running'
+            AND lease_owner = %(owner)s
+            RETURNING response_id
+        """, {"response_ids": response_ids, "owner": WORKER_ID, "lease": JOB_LEASE_DURATION})
+        rows = await cur.fetchall()
+        await conn.commit()
+        return {str(row[0]) for row in rows}
+
+# Función para devolver a la cola los jobs con lease vencido
+@tracing.traced("db.requeue_expired_jobs", DB_SPAN_ATTRIBUTES)
+async def requeue_expired_jobs() -> list:
+    """Recupera los jobs cuyo dueño dejó de renovar el lease (contenedor caído, deploy).
+
+    El intento perdido cuenta: un video que tumba al worker una y otra vez termina en 'dead'
+    y su respuesta en 'failed'. Los demás vuelven a 'queued' y su respuesta a 'pending'.
+    Devuelve pares (response_id, status nuevo).
+    """
+    failed_patch = {"transcription_failed_at": datetime.utcnow().isoformat()}
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("""
+            WITH expired AS (
+                SELECT response_id
+                FROM transcription_jobs
+                WHERE status = 'running'
+                AND lease_expires_at < CURRENT_TIMESTAMP
+                FOR UPDATE SKIP LOCKED
+            ),
+            job AS (
+                UPDATE transcription_jobs j
+                SET status = CASE WHEN j.attempts < %(max_attempts)s THEN 'queued' ELSE 'dead' END,
+                    lane = 'retry',
+                    next_run_at = CURRENT_TIMESTAMP,
+                    last_error = 'Lease vencido (worker: ' || COALESCE(j.lease_owner, 'desconocido') || ')',
+                    lease_owner = NULL,
+                    leased_at = NULL,
+                    lease_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                FROM expired
+                WHERE j.response_id = expired.response_id
+                RETURNING j.response_id, j.status, j.last_error
+            ),
+            responses_updated AS (
+                UPDATE responses r
+                SET processing_status = CASE WHEN job.status = 'queued' THEN 'pending' ELSE 'failed' END,
+                    data = CASE WHEN job.status = 'queued' THEN r.data
+                                ELSE COALESCE(r.data, '{}'::jsonb) || %(failed_patch)s
+                                     || jsonb_build_object('transcription_error', job.last_error) END,
+                    updated_at = CURRENT_TIMESTAMP
+                FROM job
+                WHERE r.id = job.response_id
+            )
+            SELECT response_id, status FROM job
+        """, {"max_attempts": JOB_MAX_ATTEMPTS, "failed_patch": Jsonb(failed_patch)})
+        rows = await cur.fetchall()
+        await conn.commit()
+        return [(str(response_id), status) for response_id, status in rows]
+
+# Función para liberar los jobs de este worker al apagarse
+@tracing.traced("db.release_jobs", DB_SPAN_ATTRIBUTES)
+async def release_jobs(response_ids: list):
+    """Devuelve a la cola, sin contar el intento, los jobs interrumpidos por un apagado ordenado"""
+    async with db_pool.connection() as conn:
+        await conn.execute("""
+            WITH job AS (
+                UPDATE transcription_jobs
+                SET status = 'queued',
+                    attempts = GREATEST(attempts - 1, 0),
+                    next_run_at = CURRENT_TIMESTAMP,
+                    lease_owner = NULL,
+                    leased_at = NULL,
+                    lease_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE response_id = ANY(%(response_ids)s::uuid[])
+                AND status = 'running'
+                AND lease_owner = %(owner)s
+                RETURNING response_id
+            )
+            UPDATE responses r
+            SET processing_status = 'pending',
+                updated_at = CURRENT_TIMESTAMP
+            FROM job
+            WHERE r.id = job.response_id
+        """, {"response_ids": response_ids, "owner": WORKER_ID})
+        await conn.commit()
+
+# Función para saber cuándo vence el próximo job en espera
+@tracing.traced("db.seconds_until_next_job", DB_SPAN_ATTRIBUTES)
+async def seconds_until_next_job() -> Optional[float]:
+    """Segundos hasta el próximo job 'queued' (0 si ya venció); None si la cola está vacía"""
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("""
+            SELECT GREATEST(EXTRACT(EPOCH FROM min(next_run_at) - CURRENT_TIMESTAMP), 0)
+            FROM transcription_jobs
+            WHERE status = 'queued'
+        """)
+        row = await cur.fetchone()
+        return float(row[0]) if row[0] is not None else None
+
+# Función para contar jobs en espera
+@tracing.traced("db.count_queued_jobs", DB_SPAN_ATTRIBUTES)
+async def count_queued_jobs() -> dict:
+    """Profundidad de la cola por carril: jobs 'queued', vencidos o esperando su reintento"""
+    async with db_pool.connection() as conn:
+        cur = await conn.execute("""
+            SELECT lane, count(*)
+            FROM transcription_jobs
+            WHERE status = 'queued'
+            GROUP BY lane
+        """)
+        counts = dict.fromkeys(JOB_LANES, 0)
+        counts.update(await cur.fetchall())
+        return counts
+
+# Función para clasificar errores de base de datos
+def is_transient_error(error: Exception) -> bool:
+    """Caídas de conexión, timeouts del pool y conflictos de bloqueo/serialización"""
+    return isinstance(error, (psycopg.OperationalError, psycopg.InterfaceError, TimeoutError))
+
+# Función para leer la caché compartida de transcripciones
+@tracing.traced("db.get_cached_transcript", DB_SPAN_ATTRIBUTES)
+async def get_cached_transcript(cache_key: str) -> Optional[dict]:
+    """Busca una transcripción en transcript_cache y actualiza su último uso"""
+    async with db_pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute("""
+                UPDATE transcript_cache
+                SET last_used_at = CURRENT_TIMESTAMP
+                WHERE cache_key = %s
+                RETURNING transcript AS text, segments
+            """, (cache_key,))
+            row = await cur.fetchone()
+        await conn.commit()
+        return row
+
+# Función para guardar en la caché compartida de transcripciones
+@tracing.traced("db.store_cached_transcript", DB_SPAN_ATTRIBUTES)
+async def store_cached_transcript(cache_key: str, transcript: str, segments: list):
+    """Guarda una transcripción en transcript_cache"""
+    async with db_pool.connection() as conn:
+        await conn.execute("""
+            INSERT INTO transcript_cache (cache_key, transcript, segments)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET transcript = EXCLUDED.transcript,
+                segments = EXCLUDED.segments,
+                last_used_at = CURRENT_TIMESTAMP
+        """, (cache_key, transcript, Jsonb(segments)))
+        await conn.commit()
+
+# Función para podar la caché compartida de transcripciones
+@tracing.traced("db.prune_transcript_cache", DB_SPAN_ATTRIBUTES)
+async def prune_transcript_cache(max_age_days: float, batch_size: int = 1000) -> int:
+    """Borra las entradas de transcript_cache sin usar hace más de `max_age_days` días.
+
+    Borra en lotes de `batch_size` por el índice de last_used_at (una transacción corta por
+    lote); SKIP LOCKED evita que dos réplicas que podan a la vez se bloqueen. Devuelve cuántas borró.
+    """
+    deleted = 0
+    while True:
+        async with db_pool.connection() as conn:
+            cur = await conn.execute("""
+                DELETE FROM transcript_cache
+                WHERE cache_key IN (
+                    SELECT cache_key
+                    FROM transcript_cache
+                    WHERE last_used_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    ORDER BY last_used_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+            """, (max_age_days * 86400, batch_size))
+            await conn.commit()
+        deleted += cur.rowcount
+        if cur.rowcount < batch_size:
+            return deleted
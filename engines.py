@@ -0,0 +1,296 @@
+import os
+import asyncio
+import hashlib
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+import openai
+from openai import AsyncOpenAI
+
+import audio
+import tracing
+
+# Dependencia opcional: solo necesaria para el motor local
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
+logger = logging.getLogger(__name__)
+
+# Motor de transcripción por defecto de este despliegue
+TRANSCRIPTION_ENGINE = os.getenv("TRANSCRIPTION_ENGINE", "openai")
+TRANSCRIPTION_LANGUAGE = os.getenv("TRANSCRIPTION_LANGUAGE", "es")  # Español
+# Motores que este despliegue acepta (por defecto o por job); synthetic solo para pruebas de carga
+ALLOWED_ENGINES = {
+    name.strip() for name in os.getenv("ALLOWED_ENGINES", "openai,local").split(",") if name.strip()
+}
+
+# Configuración del motor OpenAI
+OPENAI_WHISPER_MODEL = os.getenv("OPENAI_WHISPER_MODEL", "whisper-1")
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "1.0"))  # Segundos, se duplica en cada reintento
+
+# Contadores de llamadas a OpenAI (expuestos en /metrics)
+openai_stats = {"requests": 0, "retries": 0, "rate_limited": 0, "errors": 0}
+
+# Configuración del motor local (faster-whisper / CTranslate2 en CPU)
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_WORKERS = int(os.getenv("LOCAL_WHISPER_WORKERS", "1"))  # Transcripciones locales simultáneas
+LOCAL_WHISPER_CPU_THREADS = int(os.getenv("LOCAL_WHISPER_CPU_THREADS", str(os.cpu_count() or 1)))
+
+# Configuración del motor sintético (pruebas de carga sin llamar a OpenAI)
+SYNTHETIC_SEED = int(os.getenv("SYNTHETIC_SEED", "42"))
+SYNTHETIC_LATENCY_MEDIAN = float(os.getenv("SYNTHETIC_LATENCY_MEDIAN", "1.5"))  # Segundos de latencia base (mediana)
+SYNTHETIC_LATENCY_SIGMA = float(os.getenv("SYNTHETIC_LATENCY_SIGMA", "0.5"))  # Dispersión log-normal de la latencia
+SYNTHETIC_REALTIME_FACTOR = float(os.getenv("SYNTHETIC_REALTIME_FACTOR", "0.05"))  # Segundos extra por segundo de audio
+SYNTHETIC_ERROR_RATE = float(os.getenv("SYNTHETIC_ERROR_RATE", "0"))  # Probabilidad de error 500
+SYNTHETIC_RATE_LIMIT_RATE = float(os.getenv("SYNTHETIC_RATE_LIMIT_RATE", "0"))  # Probabilidad de error 429
+SYNTHETIC_BYTES_PER_SECOND = float(os.getenv("SYNTHETIC_BYTES_PER_SECOND", "3000"))  # Para estimar duración sin ffprobe
+
+_SYNTHETIC_WORDS = (
+    "experiencia equipo proyecto cliente desarrollo aprendizaje liderazgo resultados empresa "
+    "responsabilidad comunicación objetivo desafío solución proceso calidad mejora trabajo "
+    "oportunidad conocimiento análisis gestión iniciativa compromiso tecnología área puesto"
+).split()
+_SYNTHETIC_FILLERS = "yo creo que en mi anterior trabajo siempre me gusta cuando tuve un la el con para de".split()
+
+class SyntheticEngineError(Exception):
+    """Error inyectado por el motor sintético; imita el status_code de los errores de la API de OpenAI"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+class TranscriptionResult(BaseModel):
+    text: str
+    segments: list
+
+class TranscriptionEngine:
+    """Interfaz de los motores de transcripción"""
+
+    name = ""
+    method = ""  # Valor guardado en data.transcription_method
+
+    def __init__(self, model: str, language: str):
+        self.model = model
+        self.language = language
+
+    @property
+    def cache_id(self) -> str:
+        """Identifica motor, modelo e idioma en la clave de la caché de transcripciones"""
+        return f"{self.name}:{self.model}:{self.language}"
+
+    async def transcribe(self, media_path: str) -> TranscriptionResult:
+        raise NotImplementedError
+
+class OpenAIWhisperEngine(TranscriptionEngine):
+    """Transcripción con la API de OpenAI Whisper"""
+
+    name = "openai"
+    method = "openai_whisper"
+
+    def __init__(self, model: str = OPENAI_WHISPER_MODEL, language: str = TRANSCRIPTION_LANGUAGE):
+        super().__init__(model, language)
+        # Cliente asíncrono: la subida y la transcripción no bloquean el event loop.
+        # Los reintentos los hace este motor para poder contarlos.
+        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """429 (salvo falta de cuota), errores 5xx y fallas de conexión/timeout"""
+        if isinstance(error, openai.RateLimitError):
+            return getattr(error, "code", None) != "insufficient_quota"
+        return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+    async def _request(self, media_path: str):
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            openai_stats["requests"] += 1
+            try:
+                with tracing.tracer.start_as_current_span(
+                    "openai.audio.transcriptions",
+                    attributes={"openai.model": self.model, "attempt": attempt, "file.size": os.path.getsize(media_path)},
+                ), open(media_path, "rb") as audio_file:
+                    # Transcribir con timestamps
+                    return await self.client.audio.transcriptions.create(
+                        model=self.model,
+                        file=audio_file,
+                        response_format="verbose_json",
+                        language=self.language
+                    )
+            except Exception as e:
+                if isinstance(e, openai.RateLimitError):
+                    openai_stats["rate_limited"] += 1
+                if attempt == OPENAI_MAX_RETRIES or not self._is_retryable(e):
+                    openai_stats["errors"] += 1
+                    raise
+                openai_stats["retries"] += 1
+                delay = OPENAI_RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Error de OpenAI ({type(e).__name__}), reintentando en {delay:.1f} segundos")
+                await asyncio.sleep(delay)
+
+    async def transcribe(self, media_path: str) -> TranscriptionResult:
+        transcript = await self._request(media_path)
+
+        # Extraer texto y segmentos con timestamps
+        # El resultado de OpenAI en formato verbose_json es un diccionario
+        if hasattr(transcript, 'text'):
+            # Es un objeto con atributos
+            text = transcript.text
+            segments = [
+                {
+                    "start": seg.start if hasattr(seg, 'start') else seg.get('start', 0),
+                    "end": seg.end if hasattr(seg, 'end') else seg.get('end', 0),
+                    "text": seg.text if hasattr(seg, 'text') else seg.get('text', '')
+                }
+                for seg in (transcript.segments if hasattr(transcript, 'segments') else transcript.get('segments', []))
+            ]
+        else:
+            # Es un diccionario
+            text = transcript.get('text', '')
+            segments = [
+                {
+                    "start": seg.get('start', 0),
+                    "end": seg.get('end', 0),
+                    "text": seg.get('text', '')
+                }
+                for seg in transcript.get('segments', [])
+            ]
+
+        return TranscriptionResult(text=text, segments=segments)
+
+class LocalWhisperEngine(TranscriptionEngine):
+    """Transcripción local en CPU con faster-whisper (CTranslate2, cuantizado int8)"""
+
+    name = "local"
+    method = "local_whisper"
+
+    def __init__(self, model: str = LOCAL_WHISPER_MODEL, language: str = TRANSCRIPTION_LANGUAGE):
+        if WhisperModel is None:
+            raise RuntimeError("El motor local requiere el paquete faster-whisper (pip install faster-whisper)")
+        super().__init__(model, language)
+        # Executor propio: la inferencia no ocupa el executor por defecto del event loop
+        self.executor = ThreadPoolExecutor(max_workers=LOCAL_WHISPER_WORKERS, thread_name_prefix="local-whisper")
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def _load_model(self):
+        with self._model_lock:
+            if self._model is None:
+                logger.info(f"Cargando modelo local {self.model} ({LOCAL_WHISPER_COMPUTE_TYPE}, {LOCAL_WHISPER_CPU_THREADS} hilos)")
+                self._model = WhisperModel(
+                    self.model,
+                    device="cpu",
+                    compute_type=LOCAL_WHISPER_COMPUTE_TYPE,
+                    cpu_threads=LOCAL_WHISPER_CPU_THREADS,
+                    num_workers=LOCAL_WHISPER_WORKERS,
+                )
+            return self._model
+
+    def _transcribe_sync(self, media_path: str) -> TranscriptionResult:
+        model = self._load_model()
+        segments_iter, _ = model.transcribe(media_path, language=self.language)
+        # faster-whisper decodifica en forma perezosa al iterar los segmentos
+        segments = [
+            {"start": seg.start, "end": seg.end, "text": seg.text}
+            for seg in segments_iter
+        ]
+        text = " ".join(seg["text"].strip() for seg in segments if seg["text"].strip())
+        return TranscriptionResult(text=text, segments=segments)
+
+    async def transcribe(self, media_path: str) -> TranscriptionResult:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._transcribe_sync, media_path)
+
+class SyntheticEngine(TranscriptionEngine):
+    """Motor determinista para pruebas de carga: latencia realista, segmentos según la duración y errores inyectables.
+
+    El texto depende solo del contenido del archivo y de SYNTHETIC_SEED; la secuencia de latencias y errores
+    depende solo de SYNTHETIC_SEED y del orden de las llamadas.
+    """
+
+    name = "synthetic"
+    method = "synthetic"
+
+    def __init__(self, model: str = "synthetic-v1", language: str = TRANSCRIPTION_LANGUAGE):
+        super().__init__(model, language)
+        self._rng = random.Random(SYNTHETIC_SEED)
+
+    async def _duration(self, media_path: str) -> float:
+        duration = await audio.probe_duration(media_path)
+        if duration is None:
+            duration = os.path.getsize(media_path) / SYNTHETIC_BYTES_PER_SECOND
+        return max(duration, 1.0)
+
+    def _content_rng(self, media_path: str) -> random.Random:
+        digest = hashlib.sha256(str(SYNTHETIC_SEED).encode())
+        with open(media_path, "rb") as media_file:
+            for block in iter(lambda: media_file.read(1024 * 1024), b""):
+                digest.update(block)
+        return random.Random(digest.hexdigest())
+
+    def _segments(self, rng: random.Random, duration: float) -> list:
+        """Segmentos de 2-6 s a ~2.5 palabras por segundo hasta cubrir la duración"""
+        segments = []
+        position = 0.0
+        while position < duration:
+            length = min(rng.uniform(2.0, 6.0), duration - position)
+            word_count = max(1, int(length * rng.uniform(2.0, 3.0)))
+            words = [rng.choice(_SYNTHETIC_WORDS if rng.random() < 0.4 else _SYNTHETIC_FILLERS) for _ in range(word_count)]
+            segments.append({
+                "start": round(position, 3),
+                "end": round(position + length, 3),
+                "text": " " + " ".join(words).capitalize() + "."
+            })
+            position += length
+        return segments
+
+    async def transcribe(self, media_path: str) -> TranscriptionResult:
+        duration = await self._duration(media_path)
+        latency = self._rng.lognormvariate(0, SYNTHETIC_LATENCY_SIGMA) * SYNTHETIC_LATENCY_MEDIAN
+        latency += duration * SYNTHETIC_REALTIME_FACTOR
+        outcome = self._rng.random()
+
+        await asyncio.sleep(latency)
+
+        if outcome < SYNTHETIC_RATE_LIMIT_RATE:
+            raise SyntheticEngineError("Synthetic rate limit exceeded", status_code=429)
+        if outcome < SYNTHETIC_RATE_LIMIT_RATE + SYNTHETIC_ERROR_RATE:
+            raise SyntheticEngineError("Synthetic transcription failure", status_code=500)
+
+        rng = await asyncio.to_thread(self._content_rng, media_path)
+        segments = self._segments(rng, duration)
+        text = " ".join(seg["text"].strip() for seg in segments)
+        return TranscriptionResult(text=text, segments=segments)
+
+# Función para clasificar errores de los motores
+def is_transient_error(error: Exception) -> bool:
+    """Rate limit (salvo falta de cuota), 5xx y fallas de red: vale la pena reintentar el job más tarde"""
+    if isinstance(error, SyntheticEngineError):
+        return error.status_code == 429 or error.status_code >= 500
+    return OpenAIWhisperEngine._is_retryable(error)
+
+# Motores disponibles por nombre
+ENGINES = {
+    OpenAIWhisperEngine.name: OpenAIWhisperEngine,
+    LocalWhisperEngine.name: LocalWhisperEngine,
+    SyntheticEngine.name: SyntheticEngine,
+}
+
+_engine_instances: Dict[str, TranscriptionEngine] = {}
+
+def get_engine(name: Optional[str] = None) -> TranscriptionEngine:
+    """Devuelve el motor pedido (o el del despliegue), creándolo una sola vez por proceso"""
+    name = name or TRANSCRIPTION_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"Motor de transcripción desconocido: {name}")
+    if name not in ALLOWED_ENGINES:
+        raise ValueError(f"Motor de transcripción no habilitado en este despliegue: {name}")
+    if name not in _engine_instances:
+        _engine_instances[name] = ENGINES[name]()
+    return _engine_instances[name]
@@ -0,0 +1,43 @@
+import os
+from typing import Optional
+
+# Carriles de prioridad de la cola de jobs, de mayor a menor (migrations/006_job_lanes.sql)
+JOB_LANES = ("webhook", "retry", "backfill")
+
+# Parte de los cupos del worker reservada a cada carril; los cupos que un carril no usa los
+# toman los demás, en orden de prioridad
+LANE_WEIGHTS = {
+    lane: float(weight)
+    for lane, weight in (item.split(":") for item in os.getenv("LANE_WEIGHTS", "webhook:6,retry:2,backfill:2").split(","))
+}
+
+# Función para repartir los cupos del worker entre los carriles
+def lane_shares(total_slots: int, weights: Optional[dict] = None) -> dict:
+    """Reparte `total_slots` cupos según los pesos con el método del resto mayor.
+
+    Cada carril recibe la parte entera de su cuota y los cupos restantes van a los de mayor
+    fracción (a igual fracción, al más prioritario). Si hay al menos un cupo por carril con
+    peso, ninguno queda en cero: se le cede un cupo del carril con más cupos.
+    """
+    weights = LANE_WEIGHTS if weights is None else weights
+    active = [lane for lane in JOB_LANES if weights.get(lane, 0) > 0]
+    shares = dict.fromkeys(JOB_LANES, 0)
+    if not active or total_slots <= 0:
+        return shares
+
+    weight_sum = sum(weights[lane] for lane in active)
+    quotas = {lane: total_slots * weights[lane] / weight_sum for lane in active}
+    for lane in active:
+        shares[lane] = int(quotas[lane])
+    remainder = total_slots - sum(shares.values())
+    by_fraction = sorted(active, key=lambda lane: (-(quotas[lane] - shares[lane]), JOB_LANES.index(lane)))
+    for lane in by_fraction[:remainder]:
+        shares[lane] += 1
+
+    if total_slots >= len(active):
+        for lane in active:
+            if shares[lane] == 0:
+                donor = max(active, key=lambda candidate: shares[candidate])
+                shares[donor] -= 1
+                shares[lane] += 1
+    return shares
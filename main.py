@@ -1,23 +1,43 @@
 import os
 import asyncio
 import tempfile
-from typing import Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
 import logging
-import json
 import base64
+import hashlib
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from openai import OpenAI
 import requests
+import aiofiles
 from dotenv import load_dotenv
 
-# Cargar variables de entorno
+# Cargar variables de entorno antes de importar los módulos que leen su configuración
 load_dotenv()
 
+import db
+import audio
+import cache
+from cache import transcript_cache
+import engines
+import lanes
+from engines import TranscriptionEngine, TranscriptionResult, ENGINES, get_engine
+import metrics
+import tracing
+from db import (
+    db_pool,
+    get_response_data,
+    claim_response,
+    update_response_with_transcript,
+    fail_job,
+    mark_response_as_failed,
+)
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,313 +45,441 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+logger.info(f"Database config: host={db.DB_CONFIG['host']}, port={db.DB_CONFIG['port']}, database={db.DB_CONFIG['dbname']}")
+
 # Inicializar FastAPI
 app = FastAPI(title="Video Transcription Worker")
 
-# Configuración de PostgreSQL
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "port": os.getenv("DB_PORT", "5432"),
-    "database": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "connect_timeout": 30,  # Timeout de conexión
-    "sslmode": os.getenv("DB_SSLMODE", "prefer"),  # SSL opcional por defecto
-}
-
-logger.info(f"Database config: host={DB_CONFIG['host']}, port={DB_CONFIG['port']}, database={DB_CONFIG['database']}")
-
-# Cliente OpenAI
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Función para obtener conexión a PostgreSQL con reintentos
-def get_db_connection(max_retries=3):
-    """Crear conexión a PostgreSQL con reintentos"""
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Attempting database connection (attempt {attempt + 1}/{max_retries})")
-            conn = psycopg2.connect(**DB_CONFIG)
-            logger.info("Database connection successful")
-            return conn
-        except psycopg2.OperationalError as e:
-            logger.error(f"Database connection attempt {attempt + 1} failed: {str(e)}")
-            if attempt == max_retries - 1:
-                raise
-            logger.info(f"Retrying in 5 seconds...")
-            import time
-            time.sleep(5)
-    raise Exception("Failed to connect to database after all retries")
+# Máximo de transcripciones simultáneas por proceso
+TRANSCRIPTION_CONCURRENCY = int(os.getenv("TRANSCRIPTION_CONCURRENCY", "4"))
+_transcription_slots: Optional[asyncio.Semaphore] = None
+transcriptions_in_flight = 0
+
+def get_transcription_slots() -> asyncio.Semaphore:
+    """Semáforo que limita las llamadas concurrentes a Whisper (se crea dentro del event loop)"""
+    global _transcription_slots
+    if _transcription_slots is None:
+        _transcription_slots = asyncio.Semaphore(TRANSCRIPTION_CONCURRENCY)
+    return _transcription_slots
 
 # Variable global para controlar el proceso periódico
 periodic_task_running = False
 
+# Videos procesados en paralelo por el proceso periódico y segundos entre verificaciones
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "30"))
+# Con LISTEN/NOTIFY activo el sondeo es solo una red de seguridad
+SAFETY_POLL_INTERVAL = int(os.getenv("SAFETY_POLL_INTERVAL", "300"))
+
+# Aviso de trabajos nuevos (LISTEN/NOTIFY) para despertar al proceso periódico
+_job_wakeup: Optional[asyncio.Event] = None
+job_listener_connected = False
+job_listener_task: Optional[asyncio.Task] = None
+
+# Leases de los jobs en curso: heartbeat que los renueva y barrido de los vencidos
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))  # Debe ser bastante menor que JOB_LEASE_DURATION
+LEASE_SWEEP_INTERVAL = float(os.getenv("LEASE_SWEEP_INTERVAL", "60"))
+held_jobs = {}  # response_id -> asyncio.Task de process_video con el job tomado por este worker
+# Singleflight: una sola ejecución de process_video por response_id en este proceso
+videos_in_flight = {}  # response_id -> asyncio.Task
+lease_tasks = []
+
+def get_job_wakeup() -> asyncio.Event:
+    """Evento que despierta al proceso periódico (se crea dentro del event loop)"""
+    global _job_wakeup
+    if _job_wakeup is None:
+        _job_wakeup = asyncio.Event()
+    return _job_wakeup
+
+# Observadores de la duración de cada etapa de process_video: callables (stage, seconds)
+stage_observers = [metrics.observe_stage]
+
+def record_stage(stage: str, seconds: float):
+    """Notifica a los observadores la duración de una etapa"""
+    for observer in stage_observers:
+        observer(stage, seconds)
+
+@contextmanager
+def timed_stage(stage: str):
+    """Mide la duración de una etapa de process_video y la notifica a los observadores"""
+    started = time.perf_counter()
+    try:
+        with tracing.tracer.start_as_current_span(stage):
+            yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
 # Modelos de datos
 class WebhookPayload(BaseModel):
     response_id: str
+    engine: Optional[str] = None  # Motor de transcripción para este job (por defecto el del despliegue)
+    reprocess: bool = False  # Volver a transcribir aunque el job ya esté completado
+
+class BatchWebhookPayload(BaseModel):
+    response_ids: List[str]
+    engine: Optional[str] = None
+    lane: str = "backfill"  # Las cargas masivas no compiten con las entrevistas recién enviadas
+    reprocess: bool = False
+
+# Máximo de response_ids por llamada a /webhook/batch
+WEBHOOK_BATCH_MAX = int(os.getenv("WEBHOOK_BATCH_MAX", "1000"))
+
+# Función para ubicar el video base64 dentro de los datos
+def locate_video_data(response_data: dict) -> Optional[int]:
+    """Devuelve la posición donde empieza el video base64, o None si la respuesta no lo tiene"""
+    # Formato nuevo: data.response.data
+    if response_data.get('video_data_length'):
+        return response_data['video_data_start']
+    
+    # Formato antiguo: data.video_url (no soportado en este caso)
+    if response_data.get('has_video_url'):
+        logger.warning("Formato video_url no soportado, se requiere base64")
     
-class TranscriptionResult(BaseModel):
-    text: str
-    segments: list
+    return None
+
+# Función para decodificar el video base64 directo a disco
+async def write_video_file(response_id: str, start: int, video_path: str) -> Tuple[int, str]:
+    """Decodifica el base64 por fragmentos desde la base y los escribe al archivo.
+
+    Devuelve los bytes escritos y el SHA-256 del video decodificado (clave de la caché de transcripciones).
+    Las etapas se intercalan fragmento a fragmento, así que se acumulan y se notifican por separado:
+    stream (espera de los fragmentos de la base), decode (base64 y SHA-256) y temp_write (escritura).
+    """
+    remainder = ""
+    written = 0
+    digest = hashlib.sha256()
+    timings = dict.fromkeys(("stream", "decode", "temp_write"), 0.0)
+
+    async def write_bytes(encoded: str):
+        nonlocal written
+        started = time.perf_counter()
+        video_bytes = base64.b64decode(encoded)
+        digest.update(video_bytes)
+        decoded = time.perf_counter()
+        await video_file.write(video_bytes)
+        timings["decode"] += decoded - started
+        timings["temp_write"] += time.perf_counter() - decoded
+        written += len(video_bytes)
 
-# Función para obtener respuesta de la base de datos
-def get_response_data(response_id: str):
-    """Obtener datos de la respuesta desde PostgreSQL"""
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT r.*, q.type as question_type
-                FROM responses r
-                JOIN questions q ON r.question_id = q.id
-                WHERE r.id = %s
-            """, (response_id,))
-            return cur.fetchone()
+        async with aiofiles.open(video_path, "wb") as video_file:
+            clock = time.perf_counter()
+            async for chunk in db.stream_video_payload(response_id, start):
+                timings["stream"] += time.perf_counter() - clock
+                # Ignorar espacios/saltos de línea y decodificar solo grupos completos de 4 caracteres
+                chunk = remainder + "".join(chunk.split())
+                usable = len(chunk) - len(chunk) % 4
+                remainder = chunk[usable:]
+                if usable:
+                    await write_bytes(chunk[:usable])
+                clock = time.perf_counter()
+            timings["stream"] += time.perf_counter() - clock
+            if remainder:
+                # Un resto sin completar es base64 truncado: b64decode lanza el error de padding
+                await write_bytes(remainder)
     finally:
-        conn.close()
+        for stage, seconds in timings.items():
+            record_stage(stage, seconds)
+    return written, digest.hexdigest()
+
+# Clave de la caché: el mismo video con los mismos parámetros de transcripción da el mismo resultado
+def transcript_cache_key(media_hash: str, engine: TranscriptionEngine) -> str:
+    return f"sha256:{media_hash}:{engine.cache_id}"
+
+# Función para preparar el audio que se envía a Whisper
+async def prepare_audio(video_path: str) -> str:
+    """Devuelve la ruta del audio extraído y comprimido, o el video original si no se puede preprocesar"""
+    if not audio.AUDIO_PREPROCESSING:
+        return video_path
+    
+    if not audio.ffmpeg_available():
+        logger.warning("ffmpeg no está instalado, se enviará el video completo a Whisper")
+        return video_path
+    
+    try:
+        return await audio.extract_audio(video_path)
+    except audio.AudioProcessingError as e:
+        logger.warning(f"No se pudo extraer el audio, se enviará el video completo: {str(e)}")
+        return video_path
 
-# Función para actualizar estado de procesamiento
-def update_response_status(response_id: str, status: str):
-    """Actualizar estado de procesamiento en PostgreSQL"""
-    conn = get_db_connection()
+# Función para recortar silencios antes de transcribir
+async def remove_silences(media_path: str):
+    """Devuelve (ruta a transcribir, mapa de tiempos o None); sin ffmpeg o ante error usa el archivo original"""
+    if not audio.VAD_ENABLED or not audio.ffmpeg_available():
+        return media_path, None
+    
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE responses 
-                SET processing_status = %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            """, (status, response_id))
-            conn.commit()
-    finally:
-        conn.close()
-
-# Función para extraer video base64 de los datos
-def extract_video_data(response_data: dict) -> Optional[str]:
-    """Extrae el video base64 de la estructura de datos"""
-    data = response_data.get('data', {})
-    
-    # Buscar el video en diferentes formatos posibles
-    if isinstance(data, dict):
-        # Formato nuevo: data.response.data
-        if 'response' in data and isinstance(data['response'], dict):
-            if 'data' in data['response']:
-                return data['response']['data']
-        # Formato antiguo: data.video_url (no soportado en este caso)
-        elif 'video_url' in data:
-            logger.warning("Formato video_url no soportado, se requiere base64")
-            return None
+        trimmed = await audio.trim_silence(media_path)
+    except audio.AudioProcessingError as e:
+        logger.warning(f"No se pudieron recortar los silencios, se transcribirá el audio completo: {str(e)}")
+        return media_path, None
     
-    return None
+    return trimmed if trimmed else (media_path, None)
 
-# Función para transcribir video con OpenAI Whisper
-async def transcribe_video(video_path: str) -> TranscriptionResult:
-    """Transcribe el video usando OpenAI Whisper API"""
-    logger.info(f"Transcribiendo video: {video_path}")
+# Función para llevar los timestamps al video original
+def map_to_original_timeline(transcription: TranscriptionResult, time_map) -> TranscriptionResult:
+    """Convierte los timestamps del audio recortado a la línea de tiempo del video original"""
+    segments = [
+        {
+            **seg,
+            "start": round(time_map.to_original(seg['start']), 3),
+            "end": round(time_map.to_original(seg['end'], is_end=True), 3)
+        }
+        for seg in transcription.segments
+    ]
+    return TranscriptionResult(text=transcription.text, segments=segments)
+
+# Función para transcribir video con el motor configurado
+async def transcribe_video(video_path: str, engine: TranscriptionEngine) -> TranscriptionResult:
+    """Transcribe el video con el motor indicado (OpenAI Whisper API o Whisper local)"""
+    global transcriptions_in_flight
+    logger.info(f"Transcribiendo video con motor '{engine.name}': {video_path}")
     
     try:
-        with open(video_path, "rb") as audio_file:
-            # Transcribir con timestamps
-            transcript = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="verbose_json",
-                language="es"  # Español
-            )
-        
-        # Extraer texto y segmentos con timestamps
-        # El resultado de OpenAI en formato verbose_json es un diccionario
-        if hasattr(transcript, 'text'):
-            # Es un objeto con atributos
-            text = transcript.text
-            segments = [
-                {
-                    "start": seg.start if hasattr(seg, 'start') else seg.get('start', 0),
-                    "end": seg.end if hasattr(seg, 'end') else seg.get('end', 0),
-                    "text": seg.text if hasattr(seg, 'text') else seg.get('text', '')
-                }
-                for seg in (transcript.segments if hasattr(transcript, 'segments') else transcript.get('segments', []))
-            ]
-        else:
-            # Es un diccionario
-            text = transcript.get('text', '')
-            segments = [
-                {
-                    "start": seg.get('start', 0),
-                    "end": seg.get('end', 0),
-                    "text": seg.get('text', '')
-                }
-                for seg in transcript.get('segments', [])
-            ]
-        
-        result = TranscriptionResult(
-            text=text,
-            segments=segments
-        )
+        async with get_transcription_slots():
+            transcriptions_in_flight += 1
+            try:
+                # El span empieza con el cupo ya tomado: el hueco previo es la espera por cupo
+                with metrics.TRANSCRIPTIONS_IN_FLIGHT.track_inprogress(), tracing.tracer.start_as_current_span(
+                    "engine.transcribe", attributes={"engine": engine.name, "model": engine.model}
+                ):
+                    result = await engine.transcribe(video_path)
+            finally:
+                transcriptions_in_flight -= 1
         
         logger.info(f"Transcripción completada. Longitud: {len(result.text)} caracteres")
         return result
         
     except Exception as e:
         logger.error(f"Error transcribiendo video: {str(e)}")
+        raise
+
+# Función para unir las transcripciones de los fragmentos
+def merge_chunk_transcriptions(chunks: list, results: list) -> TranscriptionResult:
+    """Rebasa los timestamps al audio completo y descarta los segmentos duplicados del solapamiento"""
+    texts = []
+    segments = []
+    for index, (chunk, result) in enumerate(zip(chunks, results)):
+        is_last = index == len(chunks) - 1
         
-        # Fallback: Transcripción simulada cuando falla OpenAI
-        if "insufficient_quota" in str(e):
-            logger.warning("Usando transcripción simulada debido a falta de cuota en OpenAI")
-            
-            mock_text = (
-                "Hola, mi nombre es [Candidato] y estoy muy entusiasmado por esta oportunidad. "
-                "Tengo experiencia relevante en el área y creo que puedo aportar mucho valor a su equipo. "
-                "Me considero una persona proactiva, con capacidad de trabajo en equipo y siempre "
-                "dispuesto a aprender nuevas tecnologías. Gracias por considerarme para este puesto."
-            )
-            
-            # Crear segmentos simulados
-            words = mock_text.split()
-            segments = []
-            words_per_segment = 10
-            current_time = 0.0
-            
-            for i in range(0, len(words), words_per_segment):
-                segment_words = words[i:i + words_per_segment]
-                segment_text = " ".join(segment_words)
-                segments.append({
-                    "start": current_time,
-                    "end": current_time + 3.0,
-                    "text": segment_text
-                })
-                current_time += 3.0
-            
-            return TranscriptionResult(
-                text=f"[TRANSCRIPCIÓN SIMULADA - Sin créditos OpenAI]\n\n{mock_text}",
-                segments=segments
-            )
+        if not result.segments:
+            texts.append(result.text.strip())
+            continue
         
-        raise
+        for seg in result.segments:
+            start = seg['start'] + chunk.start
+            end = seg['end'] + chunk.start
+            # Cada segmento pertenece al fragmento cuyo tramo propio contiene su punto medio
+            midpoint = (start + end) / 2
+            if midpoint < chunk.keep_start or (midpoint >= chunk.keep_end and not is_last):
+                continue
+            segments.append({"start": round(start, 3), "end": round(end, 3), "text": seg['text']})
+            texts.append(seg['text'].strip())
+    
+    return TranscriptionResult(
+        text=" ".join(text for text in texts if text),
+        segments=segments
+    )
 
-# Función para actualizar respuesta con transcripción
-def update_response_with_transcript(response_id: str, transcript: str, segments: list):
-    """Actualizar respuesta con transcripción en PostgreSQL"""
-    conn = get_db_connection()
+# Función para transcribir audio completo o en fragmentos paralelos
+async def transcribe_media(media_path: str, engine: TranscriptionEngine) -> TranscriptionResult:
+    """Transcribe el archivo; si es largo lo divide en silencios y transcribe los fragmentos en paralelo"""
+    chunks = []
+    if audio.CHUNKING_ENABLED and audio.ffmpeg_available():
+        try:
+            chunks = await audio.split_audio(media_path)
+        except audio.AudioProcessingError as e:
+            logger.warning(f"No se pudo dividir el audio, se transcribirá completo: {str(e)}")
+    
+    if not chunks:
+        return await transcribe_video(media_path, engine)
+    
+    tasks = [asyncio.ensure_future(transcribe_video(chunk.path, engine)) for chunk in chunks]
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Primero obtener el data actual
-            cur.execute("SELECT data FROM responses WHERE id = %s", (response_id,))
-            result = cur.fetchone()
-            current_data = result['data'] if result else {}
-            
-            # Actualizar con transcripción
-            current_data['transcript'] = transcript
-            current_data['timestamped_transcript'] = segments
-            current_data['transcription_method'] = 'openai_whisper'
-            current_data['transcribed_at'] = datetime.utcnow().isoformat()
-            
-            # Guardar
-            cur.execute("""
-                UPDATE responses 
-                SET data = %s,
-                    processing_status = 'completed',
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            """, (json.dumps(current_data), response_id))
-            conn.commit()
+        results = await asyncio.gather(*tasks)
     finally:
-        conn.close()
+        # Si un fragmento falla, cancelar los demás (no seguir pagando llamadas a Whisper) y esperar
+        # a que terminen antes de borrar sus archivos
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for chunk in chunks:
+            if os.path.exists(chunk.path):
+                os.unlink(chunk.path)
+    
+    result = merge_chunk_transcriptions(chunks, results)
+    logger.info(f"Transcripción por fragmentos completada: {len(chunks)} fragmentos, {len(result.segments)} segmentos")
+    return result
 
-# Función para marcar respuesta como fallida
-def mark_response_as_failed(response_id: str, error: str):
-    """Marcar respuesta como fallida en PostgreSQL"""
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Obtener data actual
-            cur.execute("SELECT data FROM responses WHERE id = %s", (response_id,))
-            result = cur.fetchone()
-            current_data = result['data'] if result else {}
-            
-            # Agregar error
-            current_data['transcription_error'] = error
-            current_data['transcription_failed_at'] = datetime.utcnow().isoformat()
-            
-            # Guardar
-            cur.execute("""
-                UPDATE responses 
-                SET data = %s,
-                    processing_status = 'failed',
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            """, (json.dumps(current_data), response_id))
-            conn.commit()
-    finally:
-        conn.close()
+# Función para clasificar errores transitorios (el job se reintenta con backoff)
+def is_transient_error(error: Exception) -> bool:
+    return db.is_transient_error(error) or engines.is_transient_error(error)
 
 # Función principal de procesamiento
-async def process_video(response_id: str):
-    """Procesa un video: extrae base64, transcribe y actualiza la base de datos"""
-    logger.info(f"Iniciando procesamiento para response_id: {response_id}")
+async def process_video(response_id: str, claimed: bool = False, engine_name: Optional[str] = None,
+                        trace_context: Optional[dict] = None):
+    """Procesa un video: extrae base64, transcribe y actualiza la base de datos.
+
+    `claimed` indica que la respuesta ya fue marcada como 'processing' por el proceso periódico.
+    `engine_name` elige el motor de transcripción para este job (por defecto TRANSCRIPTION_ENGINE).
+    `trace_context` es el contexto de traza de quien encoló el job (ver tracing.job_context).
+    """
+    with tracing.job_span(response_id, trace_context):
+        logger.info(f"Iniciando procesamiento para response_id: {response_id}")
     
-    try:
-        # 1. Obtener datos de la respuesta
-        response_data = get_response_data(response_id)
+        # Si este worker ya lo está procesando, esperar ese resultado en vez de transcribir dos veces
+        running = videos_in_flight.get(response_id)
+        if running is not None:
+            logger.info(f"Response {response_id} ya se está procesando en este worker, esperando ese resultado")
+            metrics.JOBS_TOTAL.labels("deduplicated").inc()
+            if claimed:
+                # El job recién reclamado lo termina la ejecución en curso: el heartbeat debe renovarlo
+                held_jobs[response_id] = running
+            await asyncio.shield(running)
+            return
+        videos_in_flight[response_id] = asyncio.current_task()
+    
+        metrics.JOBS_IN_FLIGHT.inc()
+        holds_job = claimed  # Solo quien tiene el job registra su fallo en la cola
+        if holds_job:
+            held_jobs[response_id] = asyncio.current_task()
+    
+        try:
+            # 1. Obtener datos de la respuesta
+            with timed_stage("fetch"):
+                response_data = await get_response_data(response_id)
         
-        if not response_data:
-            raise ValueError(f"No se encontró respuesta con id: {response_id}")
+            if not response_data:
+                raise ValueError(f"No se encontró respuesta con id: {response_id}")
         
-        # Verificar que sea una pregunta de video
-        if response_data['question_type'] != 'video':
-            logger.info(f"Response {response_id} no es de tipo video, omitiendo")
-            return
+            # Verificar que sea una pregunta de video
+            if response_data['question_type'] != 'video':
+                logger.info(f"Response {response_id} no es de tipo video, omitiendo")
+                metrics.JOBS_TOTAL.labels("skipped").inc()
+                return
         
-        # 2. Marcar como processing
-        update_response_status(response_id, 'processing')
-        logger.info(f"Estado actualizado a 'processing' para response_id: {response_id}")
+            # El proceso periódico reclamó este job mientras esperábamos y nos lo pasó: ya es nuestro
+            if held_jobs.get(response_id) is asyncio.current_task():
+                holds_job = True
         
-        # 3. Extraer video base64
-        video_data = extract_video_data(response_data)
+            # 2. Reclamar y marcar como processing (evita que otra réplica procese el mismo video)
+            if not holds_job:
+                with timed_stage("claim"):
+                    won_claim = await claim_response(response_id, engine_name)
+                if not won_claim:
+                    logger.info(f"Response {response_id} ya está en curso en otro worker o ya fue transcrita, omitiendo")
+                    metrics.JOBS_TOTAL.labels("skipped").inc()
+                    return
+                holds_job = True
+                held_jobs[response_id] = asyncio.current_task()
+                logger.info(f"Estado actualizado a 'processing' para response_id: {response_id}")
         
-        if not video_data:
-            raise ValueError(f"No se encontró video base64 para response_id: {response_id}")
+            # 3. Ubicar video base64 (sin el prefijo data:video/webm;base64, si existe)
+            video_start = locate_video_data(response_data)
         
-        # 4. Decodificar base64 y guardar temporalmente
-        # Remover el prefijo data:video/webm;base64, si existe
-        if video_data.startswith('data:video'):
-            video_data = video_data.split(',')[1]
+            if video_start is None:
+                raise ValueError(f"No se encontró video base64 para response_id: {response_id}")
         
-        video_bytes = base64.b64decode(video_data)
+            logger.info(f"Video base64 de {response_data['video_data_length']} bytes para response_id: {response_id}")
         
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as tmp_file:
-            tmp_file.write(video_bytes)
-            video_path = tmp_file.name
+            with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as tmp_file:
+                video_path = tmp_file.name
+            temp_paths = [video_path]
         
-        try:
-            # 5. Transcribir
-            transcription = await transcribe_video(video_path)
+            try:
+                # 4. Decodificar base64 por fragmentos directo al archivo temporal
+                with tracing.tracer.start_as_current_span("video_file"):
+                    video_size, media_hash = await write_video_file(response_id, video_start, video_path)
+                logger.info(f"Video decodificado ({video_size} bytes, sha256 {media_hash[:12]}) en {video_path}")
             
-            # 6. Actualizar respuesta con transcripción
-            update_response_with_transcript(
-                response_id, 
-                transcription.text,
-                transcription.segments
-            )
+                # Si el mismo video ya se transcribió, reutilizar el resultado sin llamar a Whisper
+                engine = get_engine(engine_name)
+                cache_key = transcript_cache_key(media_hash, engine)
+                cached = await transcript_cache.get(cache_key) if cache.TRANSCRIPT_CACHE_ENABLED else None
+                if cached:
+                    with timed_stage("write"):
+                        written = await update_response_with_transcript(
+                            response_id, cached['text'], cached['segments'], engine.method
+                        )
+                    if not written:
+                        logger.info(f"Response {response_id} ya fue completada por otro worker, descartando resultado")
+                        metrics.JOBS_TOTAL.labels("deduplicated").inc()
+                        return
+                    logger.info(f"✅ Transcripción obtenida de caché para response_id: {response_id}")
+                    metrics.JOBS_TOTAL.labels("cached").inc()
+                    return
             
-            logger.info(f"✅ Procesamiento completado para response_id: {response_id}")
+                # 5. Extraer y comprimir el audio, recortar silencios y transcribir
+                with timed_stage("audio"):
+                    media_path = await prepare_audio(video_path)
+                    if media_path != video_path:
+                        temp_paths.append(media_path)
+                
+                    speech_path, time_map = await remove_silences(media_path)
+                    if speech_path != media_path:
+                        temp_paths.append(speech_path)
             
-        finally:
-            # Limpiar archivo temporal
-            if os.path.exists(video_path):
-                os.unlink(video_path)
+                with timed_stage("transcribe"):
+                    transcription = await transcribe_media(speech_path, engine)
+                if time_map:
+                    transcription = map_to_original_timeline(transcription, time_map)
+            
+                if cache.TRANSCRIPT_CACHE_ENABLED:
+                    await transcript_cache.put(cache_key, transcription.text, transcription.segments)
+            
+                # 6. Actualizar respuesta con transcripción
+                with timed_stage("write"):
+                    written = await update_response_with_transcript(
+                        response_id, 
+                        transcription.text,
+                        transcription.segments,
+                        engine.method
+                    )
+                if not written:
+                    logger.info(f"Response {response_id} ya fue completada por otro worker, descartando resultado")
+                    metrics.JOBS_TOTAL.labels("deduplicated").inc()
+                    return
+            
+                logger.info(f"✅ Procesamiento completado para response_id: {response_id}")
+                metrics.JOBS_TOTAL.labels("completed").inc()
+            
+            finally:
+                # Limpiar archivos temporales
+                for path in temp_paths:
+                    if os.path.exists(path):
+                        os.unlink(path)
         
-    except Exception as e:
-        logger.error(f"❌ Error procesando response_id {response_id}: {str(e)}")
+        except Exception as e:
+            logger.error(f"❌ Error procesando response_id {response_id}: {str(e)}")
+            transient = is_transient_error(e)
         
-        # Marcar como failed
-        mark_response_as_failed(response_id, str(e))
+            # Devolver el job a la cola con backoff, o pasarlo a dead-letter
+            job = await fail_job(response_id, str(e), transient) if holds_job else None
+            if job and job['status'] == 'queued':
+                logger.warning(
+                    f"Job {response_id} re-encolado (intento {job['attempts']}/{db.JOB_MAX_ATTEMPTS}), "
+                    f"próximo intento: {job['next_run_at'].isoformat()}"
+                )
+                metrics.JOBS_TOTAL.labels("retried").inc()
+            else:
+                metrics.JOBS_TOTAL.labels("failed").inc()
+                # Marcar como failed: job muerto, o error permanente antes de reclamarlo
+                if job or not (holds_job or transient):
+                    await mark_response_as_failed(response_id, str(e))
         
-        raise
+            raise
+    
+        finally:
+            if held_jobs.get(response_id) is asyncio.current_task():
+                del held_jobs[response_id]
+            if videos_in_flight.get(response_id) is asyncio.current_task():
+                del videos_in_flight[response_id]
+            metrics.JOBS_IN_FLIGHT.dec()
 
 # Endpoints
 
 @app.post("/webhook")
-async def webhook(payload: WebhookPayload, background_tasks: BackgroundTasks):
+async def webhook(payload: WebhookPayload):
     """Endpoint webhook que recibe el response_id para procesar"""
     logger.info(f"[WEBHOOK] Received request for response_id: {payload.response_id}")
     
@@ -339,9 +487,53 @@ async def webhook(payload: WebhookPayload, background_tasks: BackgroundTasks):
     if not payload.response_id:
         logger.error("[WEBHOOK] Missing response_id in payload")
         raise HTTPException(status_code=400, detail="response_id es requerido")
+    try:
+        uuid.UUID(payload.response_id)
+    except ValueError:
+        logger.error(f"[WEBHOOK] Invalid response_id: {payload.response_id}")
+        raise HTTPException(status_code=400, detail="response_id debe ser un UUID")
+    
+    # Validar motor de transcripción pedido
+    if payload.engine and payload.engine not in ENGINES:
+        logger.error(f"[WEBHOOK] Unknown transcription engine: {payload.engine}")
+        raise HTTPException(status_code=400, detail=f"Motor de transcripción desconocido: {payload.engine}")
+    if payload.engine and payload.engine not in engines.ALLOWED_ENGINES:
+        logger.error(f"[WEBHOOK] Transcription engine not allowed: {payload.engine}")
+        raise HTTPException(status_code=400, detail=f"Motor de transcripción no habilitado: {payload.engine}")
+    
+    # Encolar en el carril prioritario de webhooks; la traza del job empieza aquí
+    with tracing.tracer.start_as_current_span("webhook", attributes={"response_id": payload.response_id}):
+        trace_context = tracing.job_context()
+        try:
+            results = await db.enqueue_jobs(
+                [payload.response_id], payload.engine, "webhook", trace_context, payload.reprocess
+            )
+        except Exception as e:
+            logger.error(f"[WEBHOOK] Could not enqueue {payload.response_id}: {str(e)}")
+            raise HTTPException(status_code=503, detail="No se pudo encolar el video, reintentar más tarde")
     
-    # Agregar tarea de procesamiento en background
-    background_tasks.add_task(process_video, payload.response_id)
+    result = results.get(str(uuid.UUID(payload.response_id)))
+    if result is None:
+        logger.error(f"[WEBHOOK] No video response with id: {payload.response_id}")
+        raise HTTPException(status_code=404, detail=f"No existe una respuesta de video con id: {payload.response_id}")
+    
+    if result == "already_processing":
+        logger.info(f"[WEBHOOK] Video {payload.response_id} is already being processed")
+        return {
+            "status": "accepted",
+            "response_id": payload.response_id,
+            "message": "Video already being processed"
+        }
+    
+    if result == "already_completed":
+        logger.info(f"[WEBHOOK] Video {payload.response_id} is already transcribed")
+        return {
+            "status": "accepted",
+            "response_id": payload.response_id,
+            "message": "Video already transcribed (send reprocess: true to transcribe it again)"
+        }
+    
+    get_job_wakeup().set()
     logger.info(f"[WEBHOOK] Video {payload.response_id} queued for processing")
     
     return {
@@ -350,6 +542,58 @@ async def webhook(payload: WebhookPayload, background_tasks: BackgroundTasks):
         "message": "Video queued for processing"
     }
 
+@app.post("/webhook/batch")
+async def webhook_batch(payload: BatchWebhookPayload):
+    """Encola muchos response_id con una sola validación y una sola transacción; resultado por id"""
+    logger.info(f"[WEBHOOK] Received batch of {len(payload.response_ids)} response_ids")
+    
+    if not payload.response_ids:
+        raise HTTPException(status_code=400, detail="response_ids no puede estar vacío")
+    if len(payload.response_ids) > WEBHOOK_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Máximo {WEBHOOK_BATCH_MAX} response_ids por llamada")
+    if payload.engine and payload.engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"Motor de transcripción desconocido: {payload.engine}")
+    if payload.engine and payload.engine not in engines.ALLOWED_ENGINES:
+        raise HTTPException(status_code=400, detail=f"Motor de transcripción no habilitado: {payload.engine}")
+    if payload.lane not in db.JOB_LANES:
+        raise HTTPException(status_code=400, detail=f"Carril desconocido: {payload.lane}")
+    
+    # UUID canónico de cada id recibido (None si no es un UUID válido)
+    canonical_ids = {}
+    for response_id in payload.response_ids:
+        try:
+            canonical_ids[response_id] = str(uuid.UUID(response_id))
+        except ValueError:
+            canonical_ids[response_id] = None
+    valid_ids = [canonical for canonical in canonical_ids.values() if canonical]
+    
+    with tracing.tracer.start_as_current_span("webhook.batch", attributes={"batch.size": len(payload.response_ids)}):
+        trace_context = tracing.job_context()
+        try:
+            results = await db.enqueue_jobs(
+                valid_ids, payload.engine, payload.lane, trace_context, payload.reprocess
+            ) if valid_ids else {}
+        except Exception as e:
+            logger.error(f"[WEBHOOK] Could not enqueue batch: {str(e)}")
+            raise HTTPException(status_code=503, detail="No se pudo encolar el lote, reintentar más tarde")
+    
+    response_results = []
+    for response_id, canonical in canonical_ids.items():
+        status = "invalid_id" if canonical is None else results.get(canonical, "not_found")
+        response_results.append({"response_id": response_id, "status": status})
+    
+    # Respuestas distintas encoladas (un id repetido o con otras mayúsculas cuenta una vez)
+    queued = len({canonical_ids[result["response_id"]] for result in response_results if result["status"] == "queued"})
+    if queued:
+        get_job_wakeup().set()
+    logger.info(f"[WEBHOOK] Batch: {queued}/{len(response_results)} videos queued in lane '{payload.lane}'")
+    
+    return {
+        "status": "accepted",
+        "queued": queued,
+        "results": response_results
+    }
+
 @app.get("/")
 async def root():
     """Endpoint raíz para verificar que el worker está corriendo"""
@@ -357,7 +601,7 @@ async def root():
         "service": "Video Transcription Worker",
         "status": "running",
         "timestamp": datetime.now().isoformat(),
-        "endpoints": ["/health", "/webhook"]
+        "endpoints": ["/health", "/webhook", "/webhook/batch", "/metrics"]
     }
 
 @app.get("/health")
@@ -365,13 +609,8 @@ async def health():
     """Endpoint de salud detallado"""
     db_status = "unknown"
     try:
-        # Verificar conexión con PostgreSQL con timeout reducido
-        conn = get_db_connection(max_retries=1)
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1")
-            result = cur.fetchone()
-            db_status = "connected" if result else "error"
-        conn.close()
+        # Verificar conexión con PostgreSQL usando el pool compartido
+        db_status = "connected" if await db.ping() else "error"
     except Exception as e:
         db_status = f"disconnected: {str(e)}"
     
@@ -389,77 +628,234 @@ async def health():
         "status": "healthy" if db_status == "connected" else "unhealthy",
         "timestamp": datetime.now().isoformat(),
         "periodic_task_running": periodic_task_running,
+        "job_listener_connected": job_listener_connected,
+        "lane_shares": lanes.lane_shares(WORKER_CONCURRENCY),
+        "transcriptions": {
+            "in_flight": transcriptions_in_flight,
+            "max_concurrency": TRANSCRIPTION_CONCURRENCY,
+            "cache": transcript_cache.stats
+        },
         "services": {
             "database": db_status,
+            "database_pool": db_pool.metrics(),
             "environment": env_status
         }
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas en formato Prometheus"""
+    try:
+        for lane, depth in (await db.count_queued_jobs()).items():
+            metrics.QUEUE_DEPTH.labels(lane).set(depth)
+    except Exception as e:
+        logger.warning(f"No se pudo obtener la profundidad de la cola: {str(e)}")
+    
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+# Función para reclamar jobs respetando la parte de cupos de cada carril
+async def claim_lane_jobs(free_slots: int, active_by_lane: Counter) -> list:
+    """Primero cada carril hasta su cuota; los cupos sobrantes van a los carriles con más prioridad.
+
+    Si falla el reclamo de un carril después de haber tomado jobs, devuelve los ya tomados para
+    que se procesen (sus leases son de este worker); solo propaga el error si no tomó ninguno.
+    """
+    shares = lanes.lane_shares(WORKER_CONCURRENCY)
+    claimed = []
+    exhausted = set()
+    try:
+        for lane in db.JOB_LANES:
+            wanted = min(shares[lane] - active_by_lane[lane], free_slots - len(claimed))
+            if wanted > 0:
+                jobs = await db.claim_pending_jobs(wanted, lane)
+                claimed += jobs
+                if len(jobs) < wanted:
+                    exhausted.add(lane)
+        for lane in db.JOB_LANES:
+            wanted = free_slots - len(claimed)
+            if wanted <= 0:
+                break
+            if lane not in exhausted:
+                claimed += await db.claim_pending_jobs(wanted, lane)
+    except Exception as e:
+        if not claimed:
+            raise
+        logger.warning(f"Reclamo de jobs interrumpido tras tomar {len(claimed)}: {str(e)}")
+    return claimed
+
 # Proceso periódico para buscar videos pendientes
 async def process_pending_videos():
-    """Busca y procesa videos pendientes cada 30 segundos"""
+    """Busca videos pendientes y los procesa en paralelo, rellenando cupos a medida que se liberan"""
     global periodic_task_running
     consecutive_failures = 0
     max_consecutive_failures = 5
+    active_jobs = {}  # asyncio.Task -> (response_id, carril)
     
     while periodic_task_running:
-        try:
-            logger.info("Buscando videos pendientes...")
-            
-            # Buscar respuestas pendientes en PostgreSQL
-            conn = get_db_connection(max_retries=2)  # Reducir reintentos en proceso periódico
+        free_slots = WORKER_CONCURRENCY - len(active_jobs)
+        next_job_due = None
+        
+        if free_slots > 0:
             try:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute("""
-                        SELECT r.id, r.data, q.type as question_type
-                        FROM responses r
-                        JOIN questions q ON r.question_id = q.id
-                        WHERE r.processing_status = 'pending'
-                        AND q.type = 'video'
-                        LIMIT 10
-                    """)
-                    pending_responses = cur.fetchall()
-            finally:
-                conn.close()
-            
-            if pending_responses:
-                logger.info(f"Encontrados {len(pending_responses)} videos pendientes")
+                logger.info(f"Buscando videos pendientes ({free_slots} cupos libres)...")
                 
-                for response in pending_responses:
-                    try:
-                        await process_video(response['id'])
-                    except Exception as e:
-                        logger.error(f"Error procesando video {response['id']}: {str(e)}")
-            else:
-                logger.info("No hay videos pendientes")
-            
-            # Reset contador de fallos consecutivos en caso de éxito
-            consecutive_failures = 0
+                # Reclamar jobs vencidos en PostgreSQL por carril (seguro con varias réplicas)
+                active_by_lane = Counter(lane for _, lane in active_jobs.values())
+                with tracing.tracer.start_as_current_span("poller.claim") as claim_span:
+                    claimed_jobs = await claim_lane_jobs(free_slots, active_by_lane)
+                    claim_span.set_attribute("claimed", len(claimed_jobs))
+                    claim_context = tracing.job_context()
                 
-        except Exception as e:
-            consecutive_failures += 1
-            logger.error(f"Error en proceso periódico (intento {consecutive_failures}/{max_consecutive_failures}): {str(e)}")
-            
-            # Si hay muchos fallos consecutivos, incrementar el tiempo de espera
-            if consecutive_failures >= max_consecutive_failures:
-                wait_time = 300  # 5 minutos
-                logger.warning(f"Demasiados fallos consecutivos. Esperando {wait_time} segundos antes del siguiente intento.")
-                await asyncio.sleep(wait_time)
-                consecutive_failures = 0  # Reset después del tiempo extendido
+                if claimed_jobs:
+                    logger.info(
+                        f"Reclamados {len(claimed_jobs)} videos pendientes "
+                        f"({dict(Counter(job['lane'] for job in claimed_jobs))})"
+                    )
+                    
+                    for job in claimed_jobs:
+                        metrics.LANE_WAIT_SECONDS.labels(job["lane"]).observe(max(job["wait_seconds"], 0))
+                        # Los jobs del webhook siguen la traza que empezó en /webhook
+                        task = asyncio.create_task(process_video(
+                            job["response_id"],
+                            claimed=True,
+                            engine_name=job["engine"],
+                            trace_context=job["trace_context"] or claim_context,
+                        ))
+                        active_jobs[task] = (job["response_id"], job["lane"])
+                else:
+                    logger.info("No hay videos pendientes")
+                
+                # Con cupos libres, despertar cuando venza el próximo reintento en backoff
+                if len(claimed_jobs) < free_slots:
+                    next_job_due = await db.seconds_until_next_job()
+                
+                # Reset contador de fallos consecutivos en caso de éxito
+                consecutive_failures = 0
+                    
+            except Exception as e:
+                consecutive_failures += 1
+                logger.error(f"Error en proceso periódico (intento {consecutive_failures}/{max_consecutive_failures}): {str(e)}")
+                
+                # Si hay muchos fallos consecutivos, incrementar el tiempo de espera
+                if consecutive_failures >= max_consecutive_failures:
+                    wait_time = 300  # 5 minutos
+                    logger.warning(f"Demasiados fallos consecutivos. Esperando {wait_time} segundos antes del siguiente intento.")
+                    await asyncio.sleep(wait_time)
+                    consecutive_failures = 0  # Reset después del tiempo extendido
+                    continue
+        
+        # Esperar a que se libere un cupo, llegue un NOTIFY o toque la siguiente verificación
+        base_interval = SAFETY_POLL_INTERVAL if job_listener_connected else POLL_INTERVAL
+        wait_time = base_interval + (consecutive_failures * 10)  # Incrementar tiempo con fallos
+        if next_job_due is not None:
+            wait_time = min(wait_time, max(next_job_due, 1))
+        wakeup = get_job_wakeup()
+        wakeup_task = asyncio.create_task(wakeup.wait())
+        done, _ = await asyncio.wait(
+            [*active_jobs.keys(), wakeup_task], timeout=wait_time, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not wakeup_task.done():
+            wakeup_task.cancel()
+        wakeup.clear()
+        
+        for task in done:
+            if task is wakeup_task:
                 continue
+            response_id, _ = active_jobs.pop(task)
+            if not task.cancelled() and task.exception():
+                logger.error(f"Error procesando video {response_id}: {str(task.exception())}")
+
+# Escucha de trabajos nuevos vía LISTEN/NOTIFY
+async def listen_for_new_jobs():
+    """Despierta al proceso periódico en cuanto PostgreSQL notifica una respuesta pendiente"""
+    global job_listener_connected
+    retry_delay = 1
+    
+    while periodic_task_running:
+        try:
+            async with db.job_notifications() as notifications:
+                job_listener_connected = True
+                retry_delay = 1
+                logger.info(f"Escuchando notificaciones en el canal '{db.JOBS_CHANNEL}'")
+                # Revisar de inmediato por si se perdieron avisos mientras no escuchábamos
+                get_job_wakeup().set()
+                
+                async for notification in notifications:
+                    logger.info(f"[NOTIFY] Respuesta pendiente: {notification.payload}")
+                    get_job_wakeup().set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error en escucha de notificaciones: {str(e)}. Reintentando en {retry_delay} segundos")
+        finally:
+            job_listener_connected = False
         
-        # Esperar 30 segundos antes de la siguiente verificación (o más si hay problemas)
-        wait_time = 30 + (consecutive_failures * 10)  # Incrementar tiempo con fallos
-        await asyncio.sleep(wait_time)
+        await asyncio.sleep(retry_delay)
+        retry_delay = min(retry_delay * 2, 60)
+
+# Heartbeat de los leases de los jobs en curso
+async def heartbeat_leases():
+    """Renueva en una sola sentencia los leases de todos los jobs que este worker está procesando"""
+    while periodic_task_running:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        if not held_jobs:
+            continue
+        response_ids = list(held_jobs)
+        try:
+            still_held = await db.extend_leases(response_ids)
+        except Exception as e:
+            logger.error(f"Error renovando leases de {len(response_ids)} jobs: {str(e)}")
+            continue
+        for response_id in response_ids:
+            if response_id not in still_held and response_id in held_jobs:
+                # Otro worker ya lo devolvió a la cola; este intento termina igual, pero sin heartbeat
+                logger.warning(f"Lease perdido para response_id {response_id}")
+                del held_jobs[response_id]
+
+# Barrido de leases vencidos
+async def sweep_expired_leases():
+    """Devuelve a la cola los jobs cuyo worker dejó de renovar el lease (contenedor caído, deploy).
+
+    También poda las entradas viejas de la caché compartida de transcripciones.
+    """
+    while periodic_task_running:
+        try:
+            recovered = await db.requeue_expired_jobs()
+            for response_id, status in recovered:
+                metrics.LEASES_EXPIRED.labels(status).inc()
+                if status == 'queued':
+                    logger.warning(f"Lease vencido: response_id {response_id} devuelta a la cola")
+                else:
+                    logger.error(f"Lease vencido: response_id {response_id} agotó sus intentos, marcada como failed")
+            if any(status == 'queued' for _, status in recovered):
+                get_job_wakeup().set()
+        except Exception as e:
+            logger.error(f"Error en barrido de leases vencidos: {str(e)}")
+        
+        # El mismo barrido poda la caché compartida (a su propio intervalo)
+        await transcript_cache.prune()
+        
+        await asyncio.sleep(LEASE_SWEEP_INTERVAL)
 
 @app.on_event("startup")
 async def startup_event():
     """Inicia el proceso periódico al arrancar la aplicación"""
-    global periodic_task_running
+    global periodic_task_running, job_listener_task
     periodic_task_running = True
     
-    # Iniciar proceso periódico en background
+    tracing.setup_tracing()
+    
+    # Precalentar el pool de conexiones (un fallo aquí no impide el arranque)
+    try:
+        await db_pool.open()
+    except Exception as e:
+        logger.error(f"No se pudo precalentar el pool de conexiones: {str(e)}")
+    
+    # Iniciar proceso periódico y escucha de notificaciones en background
     asyncio.create_task(process_pending_videos())
+    job_listener_task = asyncio.create_task(listen_for_new_jobs())
+    lease_tasks.append(asyncio.create_task(heartbeat_leases()))
+    lease_tasks.append(asyncio.create_task(sweep_expired_leases()))
     logger.info("Worker iniciado - Proceso periódico activo")
 
 @app.on_event("shutdown")
@@ -467,6 +863,24 @@ async def shutdown_event():
     """Detiene el proceso periódico al cerrar la aplicación"""
     global periodic_task_running
     periodic_task_running = False
+    if job_listener_task:
+        job_listener_task.cancel()
+    for task in lease_tasks:
+        task.cancel()
+    
+    # Devolver a la cola los jobs interrumpidos, sin esperar a que venza su lease
+    if held_jobs:
+        interrupted = dict(held_jobs)
+        for task in interrupted.values():
+            task.cancel()
+        await asyncio.gather(*interrupted.values(), return_exceptions=True)
+        try:
+            await db.release_jobs(list(interrupted))
+            logger.info(f"Devueltos a la cola {len(interrupted)} jobs interrumpidos")
+        except Exception as e:
+            logger.error(f"No se pudieron liberar los jobs interrumpidos: {str(e)}")
+    await db_pool.close()
+    tracing.shutdown_tracing()
     logger.info("Worker detenido")
 
 # Para desarrollo local
@@ -0,0 +1,81 @@
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import db
+import engines
+from cache import transcript_cache
+
+# Buckets pensados para etapas que van de milisegundos (DB) a minutos (Whisper)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    "transcription_stage_seconds",
+    "Duración de cada etapa de process_video",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+JOBS_TOTAL = Counter(
+    "transcription_jobs_total",
+    "Jobs de transcripción terminados por resultado",
+    ["outcome"],  # completed | cached | retried | failed | skipped | deduplicated
+)
+JOBS_IN_FLIGHT = Gauge("transcription_jobs_in_flight", "Jobs de process_video en curso")
+TRANSCRIPTIONS_IN_FLIGHT = Gauge("transcription_engine_calls_in_flight", "Llamadas al motor de transcripción en curso")
+LEASES_EXPIRED = Counter(
+    "transcription_leases_expired",
+    "Jobs recuperados por el barrido de leases vencidos",
+    ["outcome"],  # queued | dead
+)
+QUEUE_DEPTH = Gauge(
+    "transcription_queue_depth",
+    "Jobs en transcription_jobs con status = 'queued' (incluye reintentos en backoff)",
+    ["lane"],  # webhook | retry | backfill
+)
+LANE_WAIT_SECONDS = Histogram(
+    "transcription_lane_wait_seconds",
+    "Espera de un job desde que vence hasta que el planificador lo toma, por carril",
+    ["lane"],
+    buckets=STAGE_BUCKETS,
+)
+
+def observe_stage(stage: str, seconds: float):
+    """Observador para main.stage_observers"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+class StatsCollector:
+    """Expone en cada scrape los contadores que ya llevan el pool, la caché y el motor OpenAI"""
+
+    def collect(self):
+        pool = db.db_pool.metrics()
+        connections = GaugeMetricFamily("db_pool_connections", "Conexiones del pool por estado", labels=["state"])
+        connections.add_metric(["in_use"], pool["in_use"])
+        connections.add_metric(["idle"], pool["idle"])
+        yield connections
+        yield GaugeMetricFamily("db_pool_waiting", "Corutinas esperando una conexión", value=pool["waiting"])
+        yield GaugeMetricFamily("db_pool_max_size", "Tamaño máximo del pool", value=pool["max_size"])
+        for name in ("connections_created", "connect_errors", "connections_lost", "checkouts",
+                     "checkout_errors", "returned_broken", "failed_health_checks"):
+            yield CounterMetricFamily(f"db_pool_{name}", f"Pool de conexiones: {name}", value=pool[name])
+
+        cache_lookups = CounterMetricFamily("transcript_cache_lookups", "Búsquedas en la caché de transcripciones", labels=["result"])
+        for result, value in transcript_cache.stats.items():
+            cache_lookups.add_metric([result], value)
+        yield cache_lookups
+
+        yield CounterMetricFamily("openai_requests", "Peticiones a la API de transcripción de OpenAI", value=engines.openai_stats["requests"])
+        yield CounterMetricFamily("openai_retries", "Reintentos de peticiones a OpenAI", value=engines.openai_stats["retries"])
+        yield CounterMetricFamily("openai_rate_limited", "Respuestas 429 de OpenAI", value=engines.openai_stats["rate_limited"])
+        yield CounterMetricFamily("openai_errors", "Peticiones a OpenAI fallidas sin más reintentos", value=engines.openai_stats["errors"])
+
+REGISTRY.register(StatsCollector())
+
+def render() -> bytes:
+    """Texto de exposición de Prometheus"""
+    return generate_latest(REGISTRY)
@@ -0,0 +1,19 @@
+-- Notifica al worker cuando hay una respuesta pendiente de transcribir.
+-- El worker escucha el canal 'transcription_jobs' (LISTEN) y despierta su
+-- planificador al instante; el sondeo periódico queda solo como red de seguridad.
+
+CREATE OR REPLACE FUNCTION notify_transcription_job() RETURNS trigger AS $$
+BEGIN
+    IF NEW.processing_status = 'pending' THEN
+        PERFORM pg_notify('transcription_jobs', NEW.id::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS responses_notify_transcription_job ON responses;
+
+CREATE TRIGGER responses_notify_transcription_job
+    AFTER INSERT OR UPDATE OF processing_status ON responses
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_transcription_job();
@@ -0,0 +1,8 @@
+-- Índice parcial para la búsqueda de respuestas pendientes del worker.
+-- Solo contiene las filas 'pending', así que su tamaño depende del backlog y no
+-- del total de la tabla responses; el orden por created_at permite tomar en FIFO.
+-- CONCURRENTLY no bloquea escrituras (ejecutar fuera de una transacción).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS responses_pending_created_at_idx
+    ON responses (created_at, id)
+    WHERE processing_status = 'pending';
@@ -0,0 +1,15 @@
+-- Caché compartida de transcripciones entre réplicas del worker.
+-- La clave es el hash SHA-256 del video decodificado más los parámetros de
+-- transcripción, así que un video re-subido o un job reintentado no vuelve a
+-- pagar una llamada a Whisper.
+
+CREATE TABLE IF NOT EXISTS transcript_cache (
+    cache_key TEXT PRIMARY KEY,
+    transcript TEXT NOT NULL,
+    segments JSONB NOT NULL DEFAULT '[]'::jsonb,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS transcript_cache_last_used_at_idx
+    ON transcript_cache (last_used_at);
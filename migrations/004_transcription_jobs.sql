@@ -0,0 +1,71 @@
+-- Cola durable de trabajos de transcripción.
+-- Una fila por respuesta de video: intentos, próxima ejecución, último error y
+-- quién la tiene tomada. Los fallos transitorios vuelven a 'queued' con backoff
+-- exponencial; tras JOB_MAX_ATTEMPTS intentos (o ante un error permanente) el
+-- job queda en 'dead' y la respuesta en 'failed'.
+-- responses.processing_status sigue siendo el estado visible para la aplicación.
+
+CREATE TABLE IF NOT EXISTS transcription_jobs (
+    response_id UUID PRIMARY KEY REFERENCES responses (id) ON DELETE CASCADE,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued | running | completed | dead
+    engine TEXT,                            -- Motor pedido por el webhook (NULL = el del despliegue)
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    lease_owner TEXT,
+    leased_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Solo los jobs en espera, en el orden en que el planificador los toma
+CREATE INDEX IF NOT EXISTS transcription_jobs_due_idx
+    ON transcription_jobs (next_run_at)
+    WHERE status = 'queued';
+
+-- Encolar un job cuando una respuesta de video queda 'pending'. Un job terminado
+-- o muerto se reinicia (re-procesamiento); uno en espera o en curso no se toca.
+CREATE OR REPLACE FUNCTION enqueue_transcription_job() RETURNS trigger AS $$
+BEGIN
+    IF NEW.processing_status = 'pending' AND EXISTS (
+        SELECT 1 FROM questions q
+        WHERE q.id = NEW.question_id
+        AND q.type = 'video'
+    ) THEN
+        INSERT INTO transcription_jobs (response_id)
+        VALUES (NEW.id)
+        ON CONFLICT (response_id) DO UPDATE
+            SET status = 'queued',
+                attempts = 0,
+                next_run_at = CURRENT_TIMESTAMP,
+                last_error = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE transcription_jobs.status IN ('completed', 'dead');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS responses_enqueue_transcription_job ON responses;
+
+-- Se dispara antes que responses_notify_transcription_job (orden alfabético)
+CREATE TRIGGER responses_enqueue_transcription_job
+    AFTER INSERT OR UPDATE OF processing_status ON responses
+    FOR EACH ROW
+    EXECUTE FUNCTION enqueue_transcription_job();
+
+-- Backfill: las respuestas que ya estaban pendientes. next_run_at = created_at
+-- conserva el orden FIFO con que el worker las tomaba de responses.
+INSERT INTO transcription_jobs (response_id, next_run_at)
+SELECT r.id, r.created_at
+FROM responses r
+WHERE r.processing_status = 'pending'
+AND EXISTS (
+    SELECT 1 FROM questions q
+    WHERE q.id = r.question_id
+    AND q.type = 'video'
+)
+ON CONFLICT (response_id) DO NOTHING;
+
+-- El worker ya no busca en responses: el índice de la migración 002 queda sin uso
+DROP INDEX IF EXISTS responses_pending_created_at_idx;
@@ -0,0 +1,32 @@
+-- Leases de los jobs de transcripción.
+-- Un job tomado ('running') vence en lease_expires_at; el worker que lo tiene
+-- lo extiende con un heartbeat mientras process_video corre. Si el contenedor
+-- muere, el lease vence y cualquier worker devuelve el job a la cola.
+
+ALTER TABLE transcription_jobs
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ;
+
+-- Solo los jobs en curso, ordenados por vencimiento, para el barrido de leases
+CREATE INDEX IF NOT EXISTS transcription_jobs_lease_idx
+    ON transcription_jobs (lease_expires_at)
+    WHERE status = 'running';
+
+-- Los jobs tomados antes de esta migración no tienen lease: vencen ahora
+UPDATE transcription_jobs
+SET lease_expires_at = CURRENT_TIMESTAMP
+WHERE status = 'running'
+AND lease_expires_at IS NULL;
+
+-- Respuestas de video que quedaron en 'processing' sin job (anteriores a la
+-- migración 004): se les crea un job cuyo lease vence 30 minutos después de su
+-- última actualización, así el barrido recupera las que quedaron colgadas.
+INSERT INTO transcription_jobs (response_id, status, attempts, leased_at, lease_expires_at)
+SELECT r.id, 'running', 1, r.updated_at, r.updated_at + INTERVAL '30 minutes'
+FROM responses r
+WHERE r.processing_status = 'processing'
+AND EXISTS (
+    SELECT 1 FROM questions q
+    WHERE q.id = r.question_id
+    AND q.type = 'video'
+)
+ON CONFLICT (response_id) DO NOTHING;
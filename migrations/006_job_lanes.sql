@@ -0,0 +1,47 @@
+-- Carriles de prioridad de la cola de transcripción.
+--   webhook  - respuestas recién enviadas (POST /webhook)
+--   retry    - reintentos tras un error transitorio o un lease vencido
+--   backfill - respuestas 'pending' descubiertas por el trigger o el backfill
+-- Cada carril tiene una parte ponderada de los cupos del worker (LANE_WEIGHTS),
+-- así un backlog grande no retrasa a las entrevistas que acaban de llegar.
+-- trace_context guarda la traza del webhook que encoló el job.
+
+ALTER TABLE transcription_jobs
+    ADD COLUMN IF NOT EXISTS lane TEXT NOT NULL DEFAULT 'backfill',
+    ADD COLUMN IF NOT EXISTS trace_context JSONB;
+
+-- Los reintentos ya programados pasan a su carril
+UPDATE transcription_jobs
+SET lane = 'retry'
+WHERE status = 'queued'
+AND attempts > 0;
+
+DROP INDEX IF EXISTS transcription_jobs_due_idx;
+
+CREATE INDEX IF NOT EXISTS transcription_jobs_lane_due_idx
+    ON transcription_jobs (lane, next_run_at)
+    WHERE status = 'queued';
+
+-- Un job re-procesado desde la aplicación vuelve al carril de backfill
+CREATE OR REPLACE FUNCTION enqueue_transcription_job() RETURNS trigger AS $$
+BEGIN
+    IF NEW.processing_status = 'pending' AND EXISTS (
+        SELECT 1 FROM questions q
+        WHERE q.id = NEW.question_id
+        AND q.type = 'video'
+    ) THEN
+        INSERT INTO transcription_jobs (response_id)
+        VALUES (NEW.id)
+        ON CONFLICT (response_id) DO UPDATE
+            SET status = 'queued',
+                lane = 'backfill',
+                attempts = 0,
+                next_run_at = CURRENT_TIMESTAMP,
+                last_error = NULL,
+                trace_context = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE transcription_jobs.status IN ('completed', 'dead');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+import audio
+from audio import TimeMap, plan_chunks, speech_spans
+
+class SpeechSpansTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(audio, "VAD_PADDING", 0.25)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_silence_keeps_everything(self):
+        self.assertEqual(speech_spans(10.0, []), [(0.0, 10.0)])
+
+    def test_inner_silence_keeps_padding(self):
+        self.assertEqual(speech_spans(10.0, [(2.0, 5.0)]), [(0.0, 2.25), (4.75, 10.0)])
+
+    def test_leading_and_trailing_silence_removed_without_padding(self):
+        self.assertEqual(speech_spans(10.0, [(0.0, 1.5), (8.0, 10.0)]), [(1.25, 8.25)])
+
+    def test_short_silence_merges_spans(self):
+        self.assertEqual(speech_spans(10.0, [(2.0, 2.3)]), [(0.0, 10.0)])
+
+    def test_all_silence(self):
+        self.assertEqual(speech_spans(10.0, [(0.0, 10.0)]), [])
+
+class TimeMapTest(unittest.TestCase):
+    def setUp(self):
+        self.time_map = TimeMap([(0.0, 2.0), (5.0, 8.0)])
+
+    def test_offsets(self):
+        self.assertEqual(self.time_map.offsets, [0.0, 2.0])
+        self.assertEqual(self.time_map.trimmed_duration, 5.0)
+
+    def test_inside_spans(self):
+        self.assertEqual(self.time_map.to_original(1.0), 1.0)
+        self.assertEqual(self.time_map.to_original(3.0), 6.0)
+
+    def test_boundary_start_goes_to_next_span(self):
+        self.assertEqual(self.time_map.to_original(2.0), 5.0)
+
+    def test_boundary_end_stays_in_previous_span(self):
+        self.assertEqual(self.time_map.to_original(2.0, is_end=True), 2.0)
+        self.assertEqual(self.time_map.to_original(0.0, is_end=True), 0.0)
+
+    def test_clamped_to_last_span(self):
+        self.assertEqual(self.time_map.to_original(10.0), 8.0)
+        self.assertEqual(self.time_map.to_original(5.0, is_end=True), 8.0)
+
+    def test_without_spans_is_identity(self):
+        self.assertEqual(TimeMap([]).to_original(3.5), 3.5)
+
+class PlanChunksTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(audio, "CHUNK_DURATION", 120.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_short_audio_is_one_chunk(self):
+        self.assertEqual(plan_chunks(150.0, []), [(0.0, 150.0)])
+
+    def test_cuts_at_latest_silence(self):
+        silences = [(70.0, 72.0), (100.0, 102.0), (200.0, 204.0)]
+        self.assertEqual(plan_chunks(300.0, silences), [(0.0, 101.0), (101.0, 202.0), (202.0, 300.0)])
+
+    def test_ignores_silences_too_early(self):
+        self.assertEqual(plan_chunks(200.0, [(10.0, 12.0)]), [(0.0, 120.0), (120.0, 200.0)])
+
+    def test_without_silences_cuts_at_target(self):
+        self.assertEqual(plan_chunks(300.0, []), [(0.0, 120.0), (120.0, 240.0), (240.0, 300.0)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import re
+import unittest
+from contextlib import asynccontextmanager
+from unittest import mock
+
+import db
+
+PLACEHOLDER_RE = re.compile(r"%\((\w+)\)s")
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.rowcount = len(rows)
+
+    async def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    async def fetchall(self):
+        return self.rows
+
+class FakeConnection:
+    """Registra cada consulta y devuelve siempre las mismas filas"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    async def execute(self, query, params=None):
+        self.queries.append((query, params))
+        return FakeCursor(self.rows)
+
+    async def commit(self):
+        pass
+
+class QueryParametersTest(unittest.IsolatedAsyncioTestCase):
+    def fake_pool(self, rows):
+        conn = FakeConnection(rows)
+
+        @asynccontextmanager
+        async def connection():
+            yield conn
+
+        return conn, mock.patch.object(db.db_pool, "connection", connection)
+
+    def assert_placeholders_match(self, conn):
+        self.assertTrue(conn.queries)
+        for query, params in conn.queries:
+            self.assertEqual(set(PLACEHOLDER_RE.findall(query)), set(params or {}))
+
+    async def test_claim_response(self):
+        conn, patch = self.fake_pool([("id",)])
+        with patch:
+            self.assertTrue(await db.claim_response("id", "openai"))
+            self.assertTrue(await db.claim_response("id", reprocess=True))
+        self.assert_placeholders_match(conn)
+        self.assertIs(conn.queries[0][1]["reprocess"], False)
+        self.assertIs(conn.queries[1][1]["reprocess"], True)
+
+    async def test_claim_response_lost(self):
+        conn, patch = self.fake_pool([])
+        with patch:
+            self.assertFalse(await db.claim_response("id"))
+        self.assert_placeholders_match(conn)
+
+    async def test_enqueue_jobs(self):
+        conn, patch = self.fake_pool([("id", "queued")])
+        with patch:
+            self.assertEqual(await db.enqueue_jobs(["id", "id"], reprocess=True), {"id": "queued"})
+        self.assert_placeholders_match(conn)
+        self.assertEqual(conn.queries[0][1]["response_ids"], ["id"])
+
+if __name__ == "__main__":
+    unittest.main()
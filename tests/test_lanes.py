@@ -0,0 +1,45 @@
+import unittest
+
+from lanes import JOB_LANES, lane_shares
+
+WEIGHTS = {"webhook": 6, "retry": 2, "backfill": 2}
+
+class LaneSharesTest(unittest.TestCase):
+    def test_default_weights_for_concurrency_1_to_10(self):
+        expected = {
+            1: (1, 0, 0),
+            2: (1, 1, 0),
+            3: (1, 1, 1),
+            4: (2, 1, 1),
+            5: (3, 1, 1),
+            6: (4, 1, 1),
+            7: (4, 2, 1),
+            8: (5, 2, 1),
+            9: (5, 2, 2),
+            10: (6, 2, 2),
+        }
+        for total, shares in expected.items():
+            with self.subTest(total=total):
+                self.assertEqual(lane_shares(total, WEIGHTS), dict(zip(JOB_LANES, shares)))
+
+    def test_shares_add_up_to_total(self):
+        for total in range(0, 41):
+            with self.subTest(total=total):
+                self.assertEqual(sum(lane_shares(total, WEIGHTS).values()), total)
+
+    def test_every_weighted_lane_gets_a_slot(self):
+        weights = {"webhook": 98, "retry": 1, "backfill": 1}
+        for total in range(3, 11):
+            with self.subTest(total=total):
+                shares = lane_shares(total, weights)
+                self.assertTrue(all(shares[lane] >= 1 for lane in JOB_LANES))
+
+    def test_zero_weight_lane_gets_nothing(self):
+        shares = lane_shares(5, {"webhook": 1, "retry": 1, "backfill": 0})
+        self.assertEqual(shares, {"webhook": 3, "retry": 2, "backfill": 0})
+
+    def test_no_weights(self):
+        self.assertEqual(lane_shares(4, {}), dict.fromkeys(JOB_LANES, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+import os
+import asyncio
+import base64
+import hashlib
+import binascii
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+from audio import AudioChunk
+from engines import TranscriptionResult
+
+class MergeChunkTranscriptionsTest(unittest.TestCase):
+    def test_rebases_and_drops_overlap_duplicates(self):
+        chunks = [
+            AudioChunk("a.ogg", 0.0, 101.0, 0.0, 100.0),
+            AudioChunk("b.ogg", 99.0, 200.0, 100.0, 200.0),
+        ]
+        results = [
+            TranscriptionResult(text="uno dos", segments=[
+                {"start": 0.0, "end": 50.0, "text": " uno"},
+                {"start": 98.0, "end": 100.5, "text": " dos"},
+            ]),
+            TranscriptionResult(text="dos tres", segments=[
+                {"start": 0.0, "end": 1.5, "text": " dos"},
+                {"start": 2.0, "end": 10.0, "text": " tres"},
+            ]),
+        ]
+        merged = main.merge_chunk_transcriptions(chunks, results)
+        self.assertEqual(merged.text, "uno dos tres")
+        self.assertEqual(merged.segments, [
+            {"start": 0.0, "end": 50.0, "text": " uno"},
+            {"start": 98.0, "end": 100.5, "text": " dos"},
+            {"start": 101.0, "end": 109.0, "text": " tres"},
+        ])
+
+    def test_last_chunk_keeps_segments_past_its_end(self):
+        chunks = [AudioChunk("a.ogg", 0.0, 60.0, 0.0, 60.0)]
+        results = [TranscriptionResult(text="fin", segments=[{"start": 59.0, "end": 62.0, "text": "fin"}])]
+        self.assertEqual(main.merge_chunk_transcriptions(chunks, results).segments,
+                         [{"start": 59.0, "end": 62.0, "text": "fin"}])
+
+    def test_chunk_without_segments_uses_text(self):
+        chunks = [
+            AudioChunk("a.ogg", 0.0, 101.0, 0.0, 100.0),
+            AudioChunk("b.ogg", 99.0, 200.0, 100.0, 200.0),
+        ]
+        results = [
+            TranscriptionResult(text=" hola ", segments=[]),
+            TranscriptionResult(text="mundo", segments=[{"start": 5.0, "end": 6.0, "text": "mundo"}]),
+        ]
+        merged = main.merge_chunk_transcriptions(chunks, results)
+        self.assertEqual(merged.text, "hola mundo")
+        self.assertEqual(merged.segments, [{"start": 104.0, "end": 105.0, "text": "mundo"}])
+
+class WriteVideoFileTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        fd, self.video_path = tempfile.mkstemp(suffix=".webm")
+        os.close(fd)
+        self.addCleanup(os.unlink, self.video_path)
+
+    def fake_stream(self, pieces):
+        async def stream_video_payload(response_id, start=1):
+            for piece in pieces:
+                yield piece
+        return mock.patch.object(main.db, "stream_video_payload", stream_video_payload)
+
+    async def test_pieces_not_aligned_to_base64_groups(self):
+        video = os.urandom(1001)
+        encoded = base64.b64encode(video).decode()
+        # Fragmentos de tamaños que no son múltiplos de 4, con saltos de línea intercalados
+        pieces = []
+        position = 0
+        for size in (1, 7, 13, 2, 5, 3, 11) * 40:
+            if position >= len(encoded):
+                break
+            pieces.append(encoded[position:position + size] + "\n")
+            position += size
+        pieces.append(encoded[position:])
+
+        with self.fake_stream(pieces):
+            written, media_hash = await main.write_video_file("id", 1, self.video_path)
+
+        self.assertEqual(written, len(video))
+        self.assertEqual(media_hash, hashlib.sha256(video).hexdigest())
+        with open(self.video_path, "rb") as video_file:
+            self.assertEqual(video_file.read(), video)
+
+    async def test_reports_decode_and_write_separately(self):
+        encoded = base64.b64encode(os.urandom(300)).decode()
+        observed = []
+        with self.fake_stream([encoded[:101], encoded[101:]]), \
+                mock.patch.object(main, "stage_observers", [lambda stage, seconds: observed.append(stage)]):
+            await main.write_video_file("id", 1, self.video_path)
+        self.assertEqual(observed, ["stream", "decode", "temp_write"])
+
+    async def test_truncated_payload_raises(self):
+        encoded = base64.b64encode(os.urandom(30)).decode()
+        with self.fake_stream([encoded[:10], encoded[10:-2]]):
+            with self.assertRaises(binascii.Error):
+                await main.write_video_file("id", 1, self.video_path)
+
+class TranscribeMediaTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_chunk_cancels_the_others_before_deleting_files(self):
+        chunks = []
+        for index in range(3):
+            fd, path = tempfile.mkstemp(suffix=".ogg")
+            os.close(fd)
+            chunks.append(AudioChunk(path, index * 100.0, index * 100.0 + 101, index * 100.0, index * 100.0 + 100))
+        self.addCleanup(lambda: [os.unlink(chunk.path) for chunk in chunks if os.path.exists(chunk.path)])
+        cancelled = []
+
+        async def transcribe_video(path, engine):
+            if path == chunks[0].path:
+                raise RuntimeError("falla del fragmento")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # El archivo sigue existiendo mientras el fragmento se cancela
+                cancelled.append(os.path.exists(path))
+                raise
+
+        with mock.patch.object(main.audio, "CHUNKING_ENABLED", True), \
+                mock.patch.object(main.audio, "ffmpeg_available", return_value=True), \
+                mock.patch.object(main.audio, "split_audio", mock.AsyncMock(return_value=chunks)), \
+                mock.patch.object(main, "transcribe_video", transcribe_video):
+            with self.assertRaises(RuntimeError):
+                await main.transcribe_media("video.webm", mock.Mock())
+
+        self.assertEqual(cancelled, [True, True])
+        self.assertFalse(any(os.path.exists(chunk.path) for chunk in chunks))
+
+class WebhookBatchTest(unittest.IsolatedAsyncioTestCase):
+    async def test_result_per_id(self):
+        queued = "0b6e6a4c-3f5e-4c59-9d1a-1f0c2b7f9a01"
+        missing = "6f1d2c3b-4a59-4e6f-8a7b-9c0d1e2f3a4b"
+        completed = "a1b2c3d4-e5f6-4a7b-8c9d-0e1f2a3b4c5d"
+        enqueue_jobs = mock.AsyncMock(return_value={queued: "queued", completed: "already_completed"})
+        payload = main.BatchWebhookPayload(
+            response_ids=[queued, queued, queued.upper(), "no-es-un-uuid", missing, completed],
+        )
+        with mock.patch.object(main.db, "enqueue_jobs", enqueue_jobs):
+            response = await main.webhook_batch(payload)
+
+        self.assertEqual(response["queued"], 1)
+        self.assertEqual(response["results"], [
+            {"response_id": queued, "status": "queued"},
+            {"response_id": queued.upper(), "status": "queued"},
+            {"response_id": "no-es-un-uuid", "status": "invalid_id"},
+            {"response_id": missing, "status": "not_found"},
+            {"response_id": completed, "status": "already_completed"},
+        ])
+        args = enqueue_jobs.await_args.args
+        self.assertEqual(args[0], [queued, queued, missing, completed])
+        self.assertEqual(args[2], "backfill")
+        self.assertIs(args[4], False)
+
+    async def test_only_invalid_ids_skip_the_database(self):
+        enqueue_jobs = mock.AsyncMock()
+        with mock.patch.object(main.db, "enqueue_jobs", enqueue_jobs):
+            response = await main.webhook_batch(main.BatchWebhookPayload(response_ids=["x", "y"]))
+        enqueue_jobs.assert_not_awaited()
+        self.assertEqual(response["queued"], 0)
+        self.assertEqual([result["status"] for result in response["results"]], ["invalid_id", "invalid_id"])
+
+    async def test_rejects_unknown_lane(self):
+        with self.assertRaises(main.HTTPException) as raised:
+            await main.webhook_batch(main.BatchWebhookPayload(response_ids=["x"], lane="urgente"))
+        self.assertEqual(raised.exception.status_code, 400)
+
+class ProcessVideoSingleflightTest(unittest.IsolatedAsyncioTestCase):
+    RESPONSE_ID = "0b6e6a4c-3f5e-4c59-9d1a-1f0c2b7f9a01"
+
+    def setUp(self):
+        self.fetch_released = asyncio.Event()
+        self.response_data = {"question_type": "text"}
+
+        async def get_response_data(response_id):
+            await self.fetch_released.wait()
+            return self.response_data
+
+        self.get_response_data = mock.AsyncMock(side_effect=get_response_data)
+        self.claim_response = mock.AsyncMock(return_value=True)
+        self.fail_job = mock.AsyncMock(return_value=None)
+        self.mark_response_as_failed = mock.AsyncMock()
+        for name in ("get_response_data", "claim_response", "fail_job", "mark_response_as_failed"):
+            patcher = mock.patch.object(main, name, getattr(self, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.assertNotIn(self.RESPONSE_ID, main.videos_in_flight)
+        self.assertNotIn(self.RESPONSE_ID, main.held_jobs)
+
+    async def test_duplicate_waits_for_the_running_task(self):
+        first = asyncio.create_task(main.process_video(self.RESPONSE_ID))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(main.process_video(self.RESPONSE_ID))
+        await asyncio.sleep(0)
+
+        self.assertIs(main.videos_in_flight[self.RESPONSE_ID], first)
+        self.assertFalse(second.done())
+        self.fetch_released.set()
+        await asyncio.gather(first, second)
+        self.assertEqual(self.get_response_data.await_count, 1)
+
+    async def test_claimed_duplicate_hands_the_job_over(self):
+        self.response_data = {"question_type": "video"}
+        first = asyncio.create_task(main.process_video(self.RESPONSE_ID))
+        await asyncio.sleep(0)
+        # El proceso periódico reclama el mismo job mientras la primera ejecución sigue en curso
+        second = asyncio.create_task(main.process_video(self.RESPONSE_ID, claimed=True))
+        await asyncio.sleep(0)
+        self.assertIs(main.held_jobs[self.RESPONSE_ID], first)
+
+        self.fetch_released.set()
+        with mock.patch.object(main, "locate_video_data", return_value=None):
+            results = await asyncio.gather(first, second, return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        # Quien recibió el job no lo vuelve a reclamar y registra su fallo en la cola
+        self.claim_response.assert_not_awaited()
+        self.fail_job.assert_awaited_once()
+        self.assertEqual(self.fail_job.await_args.args[0], self.RESPONSE_ID)
+        self.mark_response_as_failed.assert_not_awaited()
+
+if __name__ == "__main__":
+    unittest.main()
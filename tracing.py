@@ -0,0 +1,80 @@
+import os
+import time
+import functools
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+from opentelemetry import trace
+from opentelemetry.propagate import extract, inject
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+logger = logging.getLogger(__name__)
+
+# Destino de los spans: none | otlp (OTEL_EXPORTER_OTLP_ENDPOINT) | file (TRACING_FILE_PATH, JSON por línea)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "/tmp/transcription-traces.jsonl")
+TRACING_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "video-transcription-worker")
+
+tracer = trace.get_tracer("video-transcription-worker")
+_provider: Optional[TracerProvider] = None
+
+def setup_tracing():
+    """Configura el exportador de spans; con TRACING_EXPORTER=none los spans no se registran"""
+    global _provider
+    if TRACING_EXPORTER == "none" or _provider is not None:
+        return
+
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif TRACING_EXPORTER == "file":
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_FILE_PATH, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    else:
+        raise ValueError(f"TRACING_EXPORTER desconocido: {TRACING_EXPORTER}")
+
+    _provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+    logger.info(f"Tracing activo (exportador: {TRACING_EXPORTER})")
+
+def shutdown_tracing():
+    """Envía los spans pendientes antes de cerrar"""
+    if _provider is not None:
+        _provider.shutdown()
+
+def job_context() -> dict:
+    """Contexto de traza del span actual más el instante de encolado, para pasarlo al job"""
+    carrier = {"enqueued_at_ns": str(time.time_ns())}
+    inject(carrier)
+    return carrier
+
+@contextmanager
+def job_span(response_id: str, context: Optional[dict]):
+    """Span raíz de process_video, hijo del span que encoló el job (webhook o poller).
+
+    Si se conoce el instante de encolado, agrega un span queue.wait con el tiempo de espera en cola.
+    """
+    context = context or {}
+    parent = extract(context)
+    with tracer.start_as_current_span("process_video", context=parent, attributes={"response_id": response_id}) as span:
+        enqueued_at_ns = context.get("enqueued_at_ns")
+        if enqueued_at_ns:
+            wait = tracer.start_span("queue.wait", start_time=int(enqueued_at_ns))
+            wait.end()
+        yield span
+
+def traced(name: str, attributes: Optional[dict] = None):
+    """Decorador: ejecuta la corutina dentro de un span"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name, attributes=attributes):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator